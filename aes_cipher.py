@@ -1,11 +1,187 @@
 import base64
+import binascii
+import json
 import os
+import re
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
+NONCE_SIZE = 12
+TAG_SIZE = 16
+# طول الإطار في وضع البايتات الخام؛ القيمة FAILED_FRAME تعني فشل فك تشفير العنصر
+_FRAME_HEADER = struct.Struct(">I")
+FAILED_FRAME = 0xFFFFFFFF
+_FAILED_HEADER = _FRAME_HEADER.pack(FAILED_FRAME)
+_KEY_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class KeyRing:
+    """
+    مجموعة مفاتيح AES-GCM مع معرّف لكل مفتاح: المفتاح الحالي للتشفير، وكل المفاتيح
+    النشطة لفك التشفير. تُحمّل من ملف JSON أو من متغيرات البيئة، ويمكن تدويرها دون توقف:
+    تدوير المفتاح يكتب الملف، وبقية العمليات تعيد تحميله عند تغيّره. التدوير عملية تشغيلية
+    من سطر الأوامر فقط (python aes_cipher.py rotate)، وليس له endpoint.
+
+    صيغة الملف: {"current": "k2", "keys": {"k1": "<base64>", "k2": "<base64>"}}
+    """
+
+    def __init__(self, keys: Dict[str, bytes], current: str, path: str = None, reload_interval: float = 5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self._set(keys, current)
+
+    def _set(self, keys: Dict[str, bytes], current: str):
+        for kid in keys:
+            if not _KEY_ID.match(kid):
+                raise ValueError(f"Invalid key id: {kid!r}")
+        if current not in keys:
+            raise ValueError(f"Current key {current!r} is not in the keyring")
+        # كائن AESGCM واحد لكل مفتاح يُعاد استخدامه في كل العمليات
+        self._ciphers = {kid: AESGCM(key) for kid, key in keys.items()}
+        self._keys = dict(keys)
+        self.current = current
+
+    @classmethod
+    def from_file(cls, path: str, create: bool = False, **kwargs) -> "KeyRing":
+        if not os.path.exists(path):
+            if not create:
+                raise FileNotFoundError(path)
+            kid = cls._new_key_id()
+            keyring = cls({kid: AESGCM.generate_key(bit_length=256)}, kid, path, **kwargs)
+            keyring._save()
+            return keyring
+        keys, current = cls._read(path)
+        keyring = cls(keys, current, path, **kwargs)
+        keyring._mtime = os.stat(path).st_mtime_ns
+        return keyring
+
+    @classmethod
+    def from_env(cls) -> Optional["KeyRing"]:
+        """
+        LHJA_AES_KEYRING: مسار ملف المفاتيح (يُنشأ إذا لم يوجد)
+        LHJA_AES_KEYS: "kid1:<base64>,kid2:<base64>" مع LHJA_AES_CURRENT_KEY (الافتراضي آخر مفتاح)
+        """
+        path = os.environ.get("LHJA_AES_KEYRING")
+        if path:
+            return cls.from_file(path, create=True)
+        spec = os.environ.get("LHJA_AES_KEYS")
+        if not spec:
+            return None
+        keys = {}
+        for item in spec.split(","):
+            kid, _, key_b64 = item.strip().partition(":")
+            keys[kid] = base64.b64decode(key_b64)
+        return cls(keys, os.environ.get("LHJA_AES_CURRENT_KEY") or list(keys)[-1])
+
+    @staticmethod
+    def _new_key_id() -> str:
+        return time.strftime("k%Y%m%d%H%M%S") + os.urandom(2).hex()
+
+    @staticmethod
+    def _read(path: str) -> Tuple[Dict[str, bytes], str]:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return {kid: base64.b64decode(key) for kid, key in data["keys"].items()}, data["current"]
+
+    def _save(self):
+        data = {"current": self.current,
+                "keys": {kid: base64.b64encode(key).decode("ascii") for kid, key in self._keys.items()}}
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def reload_if_changed(self, force: bool = False) -> bool:
+        if self.path is None:
+            return False
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        self._next_check = now + self.reload_interval
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+        with self._lock:
+            keys, current = self._read(self.path)
+            self._set(keys, current)
+            self._mtime = mtime
+        return True
+
+    def rotate(self, retire: List[str] = None) -> str:
+        """
+        إضافة مفتاح جديد وجعله المفتاح الحالي. المفاتيح القديمة تبقى لفك التشفير إلا ما في retire.
+        يتطلب keyring من ملف: المفاتيح من LHJA_AES_KEYS تتغير في هذه العملية فقط، فتفشل توكنات
+        المفتاح الجديد في بقية العمليات
+        """
+        if self.path is None:
+            raise ValueError("Only a file-backed keyring (LHJA_AES_KEYRING) can be rotated")
+        import fcntl
+        with self._lock, open(f"{self.path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            keys, _ = self._read(self.path) if os.path.exists(self.path) else (dict(self._keys), self.current)
+            kid = self._new_key_id()
+            keys[kid] = AESGCM.generate_key(bit_length=256)
+            for old in retire or []:
+                keys.pop(old, None)
+            self._set(keys, kid)
+            self._save()
+            return kid
+
+    @property
+    def current_key(self) -> bytes:
+        return self._keys[self.current]
+
+    def key_ids(self) -> List[str]:
+        return list(self._keys)
+
+    def aesgcm(self, kid: str = None) -> Optional[AESGCM]:
+        if kid is None:
+            self.reload_if_changed()
+            return self._ciphers[self.current]
+        cipher = self._ciphers.get(kid)
+        if cipher is None and self.reload_if_changed(force=True):
+            cipher = self._ciphers.get(kid)
+        return cipher
+
+    def candidates(self) -> List[AESGCM]:
+        ciphers = self._ciphers
+        return [ciphers[self.current]] + [c for kid, c in ciphers.items() if kid != self.current]
+
+
 class AESCipher:
-    def __init__(self, key: bytes = None):
-        self.key = key or AESGCM.generate_key(bit_length=256)
-        self.aesgcm = AESGCM(self.key)
+    """
+    بدون keyring: مفتاح واحد والتوكن base64(nonce + ciphertext).
+    مع keyring: التوكن "<kid>.<base64(nonce + ciphertext)>" حتى يُعرف المفتاح عند فك التشفير؛
+    التوكنات القديمة بدون معرّف تُجرّب على كل المفاتيح.
+    """
+
+    def __init__(self, key: bytes = None, keyring: KeyRing = None):
+        self.keyring = keyring
+        if keyring is None:
+            self._key = key or AESGCM.generate_key(bit_length=256)
+            self._aesgcm = AESGCM(self._key)
+
+    @property
+    def key(self) -> bytes:
+        return self.keyring.current_key if self.keyring else self._key
+
+    @property
+    def key_id(self) -> Optional[str]:
+        return self.keyring.current if self.keyring else None
+
+    @property
+    def aesgcm(self) -> AESGCM:
+        return self.keyring.aesgcm() if self.keyring else self._aesgcm
 
     @staticmethod
     def generate_key() -> bytes:
@@ -19,15 +195,155 @@ class AESCipher:
     def key_from_base64(key_b64: str) -> bytes:
         return base64.b64decode(key_b64)
 
+    def _current(self) -> Tuple[str, AESGCM]:
+        if self.keyring is None:
+            return "", self._aesgcm
+        aesgcm = self.keyring.aesgcm()
+        return self.keyring.current, aesgcm
+
     def encrypt(self, plaintext: str) -> str:
-        nonce = os.urandom(12)
-        ciphertext = self.aesgcm.encrypt(nonce, plaintext.encode("utf-8"), None)
+        kid, aesgcm = self._current()
+        nonce = os.urandom(NONCE_SIZE)
+        ciphertext = aesgcm.encrypt(nonce, plaintext.encode("utf-8"), None)
         blob = nonce + ciphertext
-        return base64.b64encode(blob).decode("utf-8")
+        token = base64.b64encode(blob).decode("utf-8")
+        return f"{kid}.{token}" if kid else token
+
+    def _open(self, blob: memoryview, ciphers: List[AESGCM]) -> bytes:
+        nonce, ciphertext = blob[:NONCE_SIZE], blob[NONCE_SIZE:]
+        error = None
+        for aesgcm in ciphers:
+            try:
+                return aesgcm.decrypt(nonce, ciphertext, None)
+            except Exception as e:
+                error = e
+        raise error or ValueError("Unknown key id")
+
+    def _ciphers_for(self, kid: Optional[str]) -> List[AESGCM]:
+        if self.keyring is None:
+            return [self._aesgcm]
+        if kid is None:
+            return self.keyring.candidates()
+        aesgcm = self.keyring.aesgcm(kid)
+        return [aesgcm] if aesgcm is not None else []
+
+    def _decrypt_token(self, token: str) -> bytes:
+        kid, sep, body = token.rpartition(".")
+        return self._open(memoryview(base64.b64decode(body)), self._ciphers_for(kid if sep else None))
 
     def decrypt(self, encrypted_b64: str) -> str:
-        blob = base64.b64decode(encrypted_b64)
-        nonce = blob[:12]
-        ciphertext = blob[12:]
-        plaintext = self.aesgcm.decrypt(nonce, ciphertext, None)
-        return plaintext.decode("utf-8")
\ No newline at end of file
+        return self._decrypt_token(encrypted_b64).decode("utf-8")
+
+    def encrypt_many(self, plaintexts: List[Union[str, bytes]], raw: bool = False) -> List[Union[str, bytes]]:
+        """
+        تشفير عدة قيم دفعة واحدة بنفس AESGCM، وكل الـ nonces من استدعاء urandom واحد.
+        raw=True يُرجع [طول المعرّف + المعرّف] + nonce + ciphertext كبايتات بدلاً من base64
+        """
+        kid, aesgcm = self._current()
+        encrypt = aesgcm.encrypt
+        nonces = os.urandom(NONCE_SIZE * len(plaintexts))
+        blobs = []
+        for i, plaintext in enumerate(plaintexts):
+            nonce = nonces[i * NONCE_SIZE:(i + 1) * NONCE_SIZE]
+            data = plaintext.encode("utf-8") if isinstance(plaintext, str) else plaintext
+            blobs.append(nonce + encrypt(nonce, data, None))
+        if raw:
+            if self.keyring is None:
+                return blobs
+            head = bytes([len(kid)]) + kid.encode("ascii")
+            return [head + blob for blob in blobs]
+        prefix = f"{kid}." if kid else ""
+        return [prefix + binascii.b2a_base64(blob, newline=False).decode("ascii") for blob in blobs]
+
+    def decrypt_many(self, tokens: List[Union[str, bytes, memoryview]], raw: bool = False) -> List[Optional[Union[str, bytes]]]:
+        """
+        فك تشفير عدة قيم؛ العنصر الذي يفشل يُرجع None بدلاً من إيقاف الدفعة كاملة.
+        المفاتيح تُحل مرة واحدة لكل معرّف في الدفعة.
+        raw=True: المدخلات بصيغة encrypt_many(raw=True) والمخرجات بايتات
+        """
+        ciphers: Dict[Optional[str], List[AESGCM]] = {}
+        results = []
+        for token in tokens:
+            try:
+                if raw:
+                    blob = memoryview(token)
+                    kid = None
+                    if self.keyring is not None:
+                        size = blob[0]
+                        kid = bytes(blob[1:1 + size]).decode("ascii")
+                        blob = blob[1 + size:]
+                else:
+                    kid, sep, body = token.rpartition(".")
+                    kid = kid if sep else None
+                    blob = binascii.a2b_base64(body)
+                candidates = ciphers.get(kid)
+                if candidates is None:
+                    candidates = ciphers[kid] = self._ciphers_for(kid)
+                plaintext = self._open(blob, candidates)
+                results.append(plaintext if raw else plaintext.decode("utf-8"))
+            except Exception:
+                results.append(None)
+        return results
+
+    @staticmethod
+    def pack_frames(items: List[Optional[bytes]]) -> bytes:
+        """
+        ترميز قائمة قيم في مخزن واحد: طول من 4 بايت (big-endian) ثم القيمة
+        """
+        parts = []
+        for item in items:
+            if item is None:
+                parts.append(_FAILED_HEADER)
+            else:
+                parts.append(_FRAME_HEADER.pack(len(item)))
+                parts.append(item)
+        return b"".join(parts)
+
+    @staticmethod
+    def unpack_frames(buffer: bytes) -> List[memoryview]:
+        view = memoryview(buffer)
+        frames = []
+        offset = 0
+        while offset < len(view):
+            (size,) = _FRAME_HEADER.unpack_from(view, offset)
+            offset += _FRAME_HEADER.size
+            if size == FAILED_FRAME:
+                frames.append(None)
+                continue
+            if offset + size > len(view):
+                raise ValueError("Truncated frame")
+            frames.append(view[offset:offset + size])
+            offset += size
+        return frames
+
+
+def main(argv=None):
+    """
+    تدوير مفاتيح الـ keyring المشترك من سطر الأوامر؛ العمليات الأخرى تعيد تحميل الملف تلقائياً:
+
+        python aes_cipher.py rotate --keyring /etc/lhja/keys.json --retire k20250101000000ab12
+        python aes_cipher.py list --keyring /etc/lhja/keys.json
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the shared AES-GCM keyring")
+    parser.add_argument("command", choices=["rotate", "list"])
+    parser.add_argument("--keyring", default=os.environ.get("LHJA_AES_KEYRING"),
+                        help="keyring file (default: LHJA_AES_KEYRING)")
+    parser.add_argument("--retire", action="append", default=[], help="key id to drop after rotating")
+    args = parser.parse_args(argv)
+    if not args.keyring:
+        parser.error("--keyring or LHJA_AES_KEYRING is required")
+
+    keyring = KeyRing.from_file(args.keyring, create=args.command == "rotate")
+    if args.command == "rotate":
+        try:
+            keyring.rotate(args.retire)
+        except ValueError as e:
+            parser.error(str(e))
+    print(json.dumps({"current": keyring.current, "keys": keyring.key_ids()}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
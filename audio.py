@@ -0,0 +1,114 @@
+"""
+تقطيع النص الطويل عند حدود الجمل، ودمج المقاطع الصوتية الناتجة في ملف واحد.
+"""
+import re
+import struct
+from typing import List
+
+# صيغ يمكن دمج مقاطعها: wav بإعادة كتابة الترويسة، و pcm بالوصل المباشر،
+# و mp3 / aac (ADTS) لأنها سلسلة إطارات مستقلة. flac و opus (Ogg) تُركَّب كطلب واحد
+CONCATENABLE = {"wav", "pcm", "mp3", "aac"}
+
+_SENTENCE_END = re.compile(r"(?<=[.!?؟۔…])\s+|\n+")
+_CLAUSE_END = re.compile(r"(?<=[،؛,;:])\s+")
+
+
+def _pack(parts: List[str], max_chars: int, separator: str = " ") -> List[str]:
+    chunks, current = [], ""
+    for part in parts:
+        candidate = f"{current}{separator}{part}" if current else part
+        if len(candidate) <= max_chars:
+            current = candidate
+            continue
+        if current:
+            chunks.append(current)
+        current = part
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_sentences(text: str, max_chars: int = 400) -> List[str]:
+    """
+    تقسيم النص إلى أجزاء لا يتجاوز كل منها max_chars حرفاً، عند نهايات الجمل (. ! ? ؟ …)
+    ثم الفواصل (، ؛) ثم المسافات للجمل الأطول من الحد، مع جمع الجمل القصيرة المتتالية في جزء واحد
+    """
+    text = text.strip()
+    if len(text) <= max_chars:
+        return [text] if text else []
+    pieces = []
+    for sentence in filter(None, (s.strip() for s in _SENTENCE_END.split(text))):
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        for clause in _pack(_CLAUSE_END.split(sentence), max_chars):
+            pieces.extend([clause] if len(clause) <= max_chars else _pack(clause.split(), max_chars))
+    return _pack(pieces, max_chars)
+
+
+def _wav_parts(data: bytes):
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("Not a RIFF/WAVE file")
+    pos, fmt = 12, None
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        size = struct.unpack_from("<I", data, pos + 4)[0]
+        start = pos + 8
+        if chunk_id == b"fmt ":
+            fmt = data[start:start + size]
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAVE data chunk before fmt chunk")
+            # خدمات البث تكتب الحجم 0 أو 0xFFFFFFFF لأنها لا تعرفه مسبقاً: البيانات حتى نهاية الملف
+            end = len(data) if size in (0, 0xFFFFFFFF) or start + size > len(data) else start + size
+            return fmt, data[start:end]
+        pos = start + size + (size & 1)
+    raise ValueError("WAVE file has no data chunk")
+
+
+def concat_wav(segments: List[bytes]) -> bytes:
+    """
+    دمج عدة ملفات WAV بنفس الصيغة في ملف واحد بترويسة RIFF وأحجام صحيحة
+    """
+    fmt, frames = None, []
+    for segment in segments:
+        segment_fmt, data = _wav_parts(segment)
+        if fmt is None:
+            fmt = segment_fmt
+        elif segment_fmt[:16] != fmt[:16]:
+            raise ValueError("WAV segments have different formats")
+        block_align = struct.unpack_from("<H", segment_fmt, 12)[0] or 1
+        frames.append(data[:len(data) - len(data) % block_align])
+    data = b"".join(frames)
+    pad = b"\x00" if len(data) & 1 else b""
+    riff_size = 4 + 8 + len(fmt) + 8 + len(data) + len(pad)
+    return b"".join([
+        b"RIFF", struct.pack("<I", riff_size), b"WAVE",
+        b"fmt ", struct.pack("<I", len(fmt)), fmt,
+        b"data", struct.pack("<I", len(data)), data, pad,
+    ])
+
+
+def _strip_id3(segment: bytes, leading: bool = True, trailing: bool = True) -> bytes:
+    if leading and segment[:3] == b"ID3" and len(segment) >= 10:
+        size = (segment[6] << 21) | (segment[7] << 14) | (segment[8] << 7) | segment[9]
+        footer = 10 if segment[5] & 0x10 else 0
+        segment = segment[10 + size + footer:]
+    if trailing and len(segment) >= 128 and segment[-128:-125] == b"TAG":
+        segment = segment[:-128]
+    return segment
+
+
+def concat_audio(segments: List[bytes], file_type: str) -> bytes:
+    if len(segments) == 1:
+        return segments[0]
+    if file_type == "wav":
+        return concat_wav(segments)
+    if file_type == "pcm":
+        return b"".join(segments)
+    if file_type in ("mp3", "aac"):
+        # وسم ID3v2 في بداية المقطع الأول ووسم ID3v1 في نهاية الأخير فقط، ولا وسوم في منتصف الملف
+        return b"".join([_strip_id3(segments[0], leading=False)]
+                        + [_strip_id3(segment) for segment in segments[1:-1]]
+                        + [_strip_id3(segments[-1], trailing=False)])
+    raise ValueError(f"Cannot concatenate {file_type} audio")
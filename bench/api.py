@@ -0,0 +1,151 @@
+"""
+قياس زمن الاستجابة وعدد الطلبات في الثانية لنقاط الـ API من طرف إلى طرف،
+مع خدمات Azure (المحادثة، TTS، Blob) مستبدلة ببدائل محلية ذات زمن قابل للضبط.
+"""
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+import stub_upstream
+from blob_store import InMemoryBlobStore
+from encrypt import UserHandler
+from metrics import MetricsMiddleware
+from ratelimit import RateLimiter
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _Server:
+    def __init__(self, app, port: int):
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "max_ms": round(ordered[-1] * 1000, 3)}
+
+
+async def _load(client: httpx.AsyncClient, make_request, requests: int, concurrency: int):
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, url, kwargs = make_request(i)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {"requests": requests, "concurrency": concurrency, "errors": errors,
+            "seconds": round(elapsed, 3), "rps": round(requests / elapsed, 1), **percentiles(latencies)}
+
+
+def bench_api(requests: int = 500, concurrency: int = 50, latency_ms: float = 200, blob_latency_ms: float = 20,
+              session_rows: int = 1000, use_cache: bool = False, tts_char_ms: float = 1.0, long_text_chars: int = 2000):
+    stub_upstream.LATENCY_MS = latency_ms
+    stub_upstream.TTS_CHAR_MS = tts_char_ms
+    # نص طويل بجمل قصيرة يمر بمسار التقطيع والتركيب المتوازي
+    long_text = ("هلا والله، كيف حالك اليوم؟ " * (long_text_chars // 27 + 1))[:long_text_chars]
+    stub_port, api_port = _free_port(), _free_port()
+    stub_base = f"http://127.0.0.1:{stub_port}/openai/deployments"
+
+    with tempfile.TemporaryDirectory() as directory:
+        handler = UserHandler(db_file=os.path.join(directory, "bench.db"),
+                              blob_store=InMemoryBlobStore(latency=blob_latency_ms / 1000),
+                              # جلسة واحدة تولّد كل الحمل، فلا نريد أن يقيس الـ bench رفض حدّ المعدل
+                              rate_limiter=RateLimiter(session_rate=1e9, session_burst=1e9, company_rate=1e9,
+                                                       company_burst=1e9, max_in_flight=10 ** 6))
+        handler.setup()
+        handler.AZURE_CHAT_ENDPOINT = f"{stub_base}/gpt-4o/chat/completions"
+        handler.AZURE_TTS_ENDPOINT = f"{stub_base}/LAHJA-V1/audio/speech"
+        session_id = None
+        for i in range(session_rows):
+            session_id = handler.db1.add_session(f"company-{i % 10}", uuid.uuid4().hex, "Active", 10 ** 9, 0)
+        token = handler.cipher.encrypt(session_id)
+
+        @asynccontextmanager
+        async def lifespan(app):
+            await handler.start()
+            yield
+            await handler.aclose()
+
+        app = FastAPI(lifespan=lifespan)
+        app.add_middleware(MetricsMiddleware)
+        app.include_router(handler.get_router(), prefix="/company")
+
+        options = {"text_deployment_name": "gpt-4o", "api_version": "bench", "base_url": "bench", "use_cache": use_cache}
+        speech_options = {"speech_deployment_name": "LAHJA-V1", "api_version": "bench", "base_url": "bench",
+                          "use_cache": use_cache}
+
+        def t2t(i):
+            params = {"message": f"مرحبا {i}", "Customize_the_dialect": "najdi", "token": token}
+            return "POST", "/company/T2T", {"params": params, "json": options}
+
+        def speech(i):
+            params = {"text": f"مرحبا {i}", "Customize_the_dialect": "najdi", "token": token}
+            return "POST", "/company/ChatText2Speech", {"params": params, "json": speech_options}
+
+        def speech_long(i):
+            params = {"text": f"{i} {long_text}", "Customize_the_dialect": "najdi", "token": token}
+            return "POST", "/company/ChatText2Speech", {"params": params, "json": speech_options}
+
+        def sessions(i):
+            return "GET", "/company/sessions", {}
+
+        async def run():
+            limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}", limits=limits, timeout=120) as client:
+                return {
+                    "/T2T": await _load(client, t2t, requests, concurrency),
+                    "/ChatText2Speech": await _load(client, speech, requests, concurrency),
+                    "/ChatText2Speech (long text)": await _load(client, speech_long, max(1, requests // 10),
+                                                                min(concurrency, 10)),
+                    "/company/sessions": await _load(client, sessions, max(1, requests // 10), min(concurrency, 10)),
+                }
+
+        with _Server(stub_upstream.app, stub_port), _Server(app, api_port):
+            results = asyncio.run(run())
+        handler.db1.close()
+        handler.db.close()
+
+    return {"upstream_latency_ms": latency_ms, "blob_latency_ms": blob_latency_ms, "tts_char_ms": tts_char_ms,
+            "long_text_chars": long_text_chars,
+            "session_rows": session_rows, "use_cache": use_cache, "routes": results}
@@ -0,0 +1,59 @@
+"""
+مقارنة ملفي نتائج وإظهار التراجع في الأداء الذي يتجاوز الحد المسموح.
+
+    python -m bench.compare base.json head.json --threshold 0.10
+"""
+import argparse
+import json
+import sys
+
+# المقاييس التي يكون ارتفاعها تحسناً؛ البقية (أزمنة) يكون انخفاضها تحسناً
+HIGHER_IS_BETTER = {"ops_per_sec", "rps"}
+COMPARED = HIGHER_IS_BETTER | {"p50_ms", "p95_ms", "p99_ms"}
+
+
+def flatten(node, prefix=""):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from flatten(value, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(node, list):
+        for index, value in enumerate(node):
+            yield from flatten(value, f"{prefix}[{index}]")
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        yield prefix, node
+
+
+def compare(base, head, threshold: float):
+    base_metrics = dict(flatten(base["results"]))
+    regressions = []
+    for name, new in flatten(head["results"]):
+        metric = name.rsplit(".", 1)[-1]
+        old = base_metrics.get(name)
+        if metric not in COMPARED or not old:
+            continue
+        change = (new - old) / old
+        worse = -change if metric in HIGHER_IS_BETTER else change
+        print(f"{name:70s} {old:>12.2f} -> {new:>12.2f} ({change:+.1%})")
+        if worse > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args(argv)
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.head, encoding="utf-8") as f:
+        head = json.load(f)
+    regressions = compare(base, head, args.threshold)
+    for name in regressions:
+        print(f"REGRESSION: {name}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+قياسات الأداء الدقيقة: التشفير، عمليات GeneralDatabase، وصحة خصم الطلبات تحت التزامن.
+"""
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlitedb import SessionDB
+
+
+def _rate(count: int, seconds: float):
+    return {"ops": count, "seconds": round(seconds, 6), "ops_per_sec": round(count / seconds, 1) if seconds else None}
+
+
+def bench_crypto(iterations: int = 100000, batch_size: int = 100):
+    """
+    التشفير وفك التشفير عنصراً عنصراً مقابل encrypt_many/decrypt_many بدفعات batch_size (base64 وخام)
+    """
+    from aes_cipher import AESCipher
+
+    cipher = AESCipher()
+    plaintexts = [str(uuid.uuid4()) for _ in range(1000)]
+    batches = [[plaintexts[(i + j) % 1000] for j in range(batch_size)] for i in range(0, iterations, batch_size)]
+
+    start = time.perf_counter()
+    tokens = [cipher.encrypt(plaintexts[i % 1000]) for i in range(iterations)]
+    encrypt = _rate(iterations, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for token in tokens:
+        cipher.decrypt(token)
+    decrypt = _rate(iterations, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    token_batches = [cipher.encrypt_many(batch) for batch in batches]
+    encrypt_many = _rate(iterations, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for batch in token_batches:
+        cipher.decrypt_many(batch)
+    decrypt_many = _rate(iterations, time.perf_counter() - start)
+
+    raw_batches = [[text.encode("utf-8") for text in batch] for batch in batches]
+    start = time.perf_counter()
+    blob_batches = [cipher.encrypt_many(batch, raw=True) for batch in raw_batches]
+    encrypt_many_raw = _rate(iterations, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for batch in blob_batches:
+        AESCipher.pack_frames(cipher.decrypt_many(AESCipher.unpack_frames(AESCipher.pack_frames(batch)), raw=True))
+    decrypt_many_raw = _rate(iterations, time.perf_counter() - start)
+    return {"encrypt": encrypt, "decrypt": decrypt, "batch_size": batch_size,
+            "encrypt_many": encrypt_many, "decrypt_many": decrypt_many,
+            "encrypt_many_raw": encrypt_many_raw, "decrypt_many_raw": decrypt_many_raw}
+
+
+def _temp_db(directory: str) -> str:
+    return os.path.join(directory, f"bench-{uuid.uuid4().hex}.db")
+
+
+@contextmanager
+def _open_db(directory: str, database_url: str = None):
+    """
+    قاعدة SQLite مؤقتة، أو جدول قياس جديد باسم فريد على database_url (مثل PostgreSQL).
+    لا يُحذف أو يُعدَّل أي جدول موجود على قاعدة يحددها المستخدم؛ يُحذف جدول القياس وحده في النهاية
+    """
+    db = SessionDB(database_url or _temp_db(directory))
+    if database_url:
+        suffix = uuid.uuid4().hex[:12]
+        db.TABLE_NAME = f"{SessionDB.TABLE_NAME}_bench_{suffix}"
+        # أسماء الفهارس في PostgreSQL فريدة على مستوى المخطط، فلو بقيت كما هي لتخطاها IF NOT EXISTS
+        db.INDEXES = [dict(index, name=f"{index['name']}_bench_{suffix}") for index in SessionDB.INDEXES]
+    db.create_table()
+    try:
+        yield db
+    finally:
+        if database_url:
+            db.execute(f"DROP TABLE IF EXISTS {db.TABLE_NAME}")
+        db.close()
+
+
+def _preload(db: SessionDB, rows: int, batch: int = 50000):
+    now = datetime.now().isoformat()
+    query = (f"INSERT INTO {db.TABLE_NAME} (SessionId, CompanyId, Token, LoginTime, Status, TotalOrders, UsedOrders) "
+             "VALUES (?, ?, ?, ?, ?, ?, ?)")
+    ids = []
+    for offset in range(0, rows, batch):
+        chunk = [(str(uuid.uuid4()), f"company-{i % 100}", uuid.uuid4().hex, now, "Active", 1000000, 0)
+                 for i in range(offset, min(offset + batch, rows))]
+        db.execute_many(query, chunk)
+        ids.extend(row[0] for row in chunk)
+    return ids
+
+
+def bench_db(row_counts=(1000, 10000, 100000), sample: int = 2000, database_url: str = None):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in row_counts:
+            with _open_db(directory, database_url) as db:
+                ids = _preload(db, rows)
+                probe = [ids[i * len(ids) // sample] for i in range(min(sample, len(ids)))]
+
+                start = time.perf_counter()
+                for i in range(len(probe)):
+                    db.add_session(f"company-{i % 100}", uuid.uuid4().hex, "Active", 1000, 0)
+                insert = _rate(len(probe), time.perf_counter() - start)
+
+                start = time.perf_counter()
+                for session_id in probe:
+                    db.select(db.TABLE_NAME, ["SessionId", "CompanyId", "Token"], "SessionId=?", (session_id,))
+                select = _rate(len(probe), time.perf_counter() - start)
+
+                start = time.perf_counter()
+                for session_id in probe:
+                    db.update(db.TABLE_NAME, {"Status": "Active"}, "SessionId=?", (session_id,))
+                update = _rate(len(probe), time.perf_counter() - start)
+
+                start = time.perf_counter()
+                for session_id in probe:
+                    db.consume_orders(session_id, 1)
+                consume = _rate(len(probe), time.perf_counter() - start)
+
+            results[str(rows)] = {"insert": insert, "select": select, "update": update, "consume_orders": consume}
+    return results
+
+
+def bench_quota(threads: int = 16, per_thread: int = 500, total_orders: int = 5000, engine: bool = False,
+                database_url: str = None):
+    """
+    خصم متزامن من جلسة واحدة: يجب أن يساوي عدد الطلبات المعتمدة رصيد الجلسة تماماً
+    """
+    from quota import QuotaEngine
+
+    with tempfile.TemporaryDirectory() as directory:
+        with _open_db(directory, database_url) as db:
+            session_id = db.add_session("company-0", uuid.uuid4().hex, "Active", total_orders, 0)
+            quota = QuotaEngine(db, flush_interval=0.05).start() if engine else db
+            committed = []
+            lock = threading.Lock()
+
+            def worker():
+                count = 0
+                for i in range(per_thread):
+                    reservation = quota.reserve_orders(session_id)
+                    if reservation is None:
+                        continue
+                    if i % 10 == 0:
+                        reservation.refund()
+                    else:
+                        reservation.commit()
+                        count += 1
+                with lock:
+                    committed.append(count)
+
+            workers = [threading.Thread(target=worker) for _ in range(threads)]
+            start = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            if engine:
+                quota.close()
+            used = db.select(db.TABLE_NAME, ["UsedOrders"], "SessionId=?", (session_id,))[0][0]
+
+    return {
+        "engine": "write_behind" if engine else "sqlite",
+        "attempts": threads * per_thread,
+        "committed": sum(committed),
+        "used_orders": used,
+        "consistent": used == sum(committed) <= total_orders,
+        **_rate(threads * per_thread, elapsed),
+    }
@@ -0,0 +1,83 @@
+"""
+تشغيل قياسات الأداء وحفظ النتائج بصيغة JSON للمقارنة بين الإصدارات.
+
+    python -m bench.run --suites crypto,db,quota,api,startup --output bench-results.json
+    python -m bench.compare old.json new.json
+
+مع --database-url تعمل قياسات db و quota على قاعدة أخرى (مثل postgresql://...) بدلاً من ملف SQLite مؤقت.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return ""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LhjaApi hot-path benchmarks")
+    parser.add_argument("--suites", default="crypto,db,quota,api,startup")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--crypto-iterations", type=int, default=100000)
+    parser.add_argument("--rows", default="1000,10000,100000,1000000")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--blob-latency-ms", type=float, default=20)
+    parser.add_argument("--use-cache", action="store_true")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--import-budget-ms", type=float, default=1500)
+    args = parser.parse_args(argv)
+    suites = [name.strip() for name in args.suites.split(",") if name.strip()]
+
+    results = {}
+    if "crypto" in suites:
+        from bench.micro import bench_crypto
+        results["crypto"] = bench_crypto(args.crypto_iterations)
+    if "db" in suites:
+        from bench.micro import bench_db
+        results["db"] = bench_db([int(rows) for rows in args.rows.split(",")], database_url=args.database_url)
+    if "quota" in suites:
+        from bench.micro import bench_quota
+        results["quota"] = [bench_quota(engine=False, database_url=args.database_url),
+                            bench_quota(engine=True, database_url=args.database_url)]
+    if "api" in suites:
+        from bench.api import bench_api
+        results["api"] = bench_api(args.requests, args.concurrency, args.latency_ms, args.blob_latency_ms,
+                                   use_cache=args.use_cache)
+    if "startup" in suites:
+        from bench.startup import bench_startup
+        results["startup"] = bench_startup(budget_ms=args.import_budget_ms)
+
+    report = {
+        "meta": {
+            "commit": _commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    if any(not run["consistent"] for run in results.get("quota", [])):
+        print("quota accounting is inconsistent", file=sys.stderr)
+        return 1
+    if not results.get("startup", {}).get("within_budget", True):
+        print(f"import of main exceeds the {args.import_budget_ms:.0f} ms budget", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
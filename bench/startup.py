@@ -0,0 +1,26 @@
+"""
+زمن استيراد التطبيق (الإقلاع البارد) في عملية جديدة، مع حد أقصى يُفشل التشغيل عند تجاوزه.
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+_PROBE = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+
+def bench_startup(module: str = "main", runs: int = 5, budget_ms: float = None):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, "-c", _PROBE.format(module=module)], cwd=root, text=True)
+        samples.append(float(output.strip().splitlines()[-1]) * 1000)
+    median = statistics.median(samples)
+    return {
+        "module": module,
+        "runs": runs,
+        "median_ms": round(median, 1),
+        "max_ms": round(max(samples), 1),
+        "budget_ms": budget_ms,
+        "within_budget": budget_ms is None or median <= budget_ms,
+    }
@@ -0,0 +1,149 @@
+import asyncio
+import base64
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List
+
+from metrics import BLOB_UPLOAD_BYTES, BLOB_UPLOAD_SECONDS
+
+CONTENT_TYPES = {
+    "wav": "audio/wav",
+    "mp3": "audio/mpeg",
+    "opus": "audio/ogg",
+    "aac": "audio/aac",
+    "flac": "audio/flac",
+    "pcm": "audio/pcm",
+}
+
+
+class BlobStore(ABC):
+    """
+    رفع الملفات كـ block blob على دفعات أثناء وصول البيانات.
+
+    تُجمع الأجزاء في مخزن بحجم block_size ثم تُرفع كـ staged block، مع حد أقصى
+    max_concurrency لعدد الكتل قيد الرفع، فيبقى استهلاك الذاكرة محدوداً بـ
+    (max_concurrency + 1) * block_size مهما كان حجم الملف.
+    """
+
+    def __init__(self, block_size: int = 4 * 1024 * 1024, max_concurrency: int = 4):
+        self.block_size = block_size
+        self.max_concurrency = max_concurrency
+
+    @abstractmethod
+    def url(self, name: str) -> str:
+        ...
+
+    @abstractmethod
+    async def _stage_block(self, name: str, block_id: str, data: bytes):
+        ...
+
+    @abstractmethod
+    async def _commit_blocks(self, name: str, block_ids: List[str], content_type: str):
+        ...
+
+    @staticmethod
+    def _block_id(index: int) -> str:
+        return base64.b64encode(f"{index:08d}".encode()).decode()
+
+    async def upload_stream(self, name: str, chunks: AsyncIterator[bytes], content_type: str = None) -> int:
+        buffer = bytearray()
+        block_ids: List[str] = []
+        pending: List[asyncio.Task] = []
+        size = 0
+
+        async def stage(data: bytes):
+            block_id = self._block_id(len(block_ids))
+            block_ids.append(block_id)
+            pending.append(asyncio.ensure_future(self._stage_block(name, block_id, data)))
+            if len(pending) >= self.max_concurrency:
+                await pending.pop(0)
+
+        start = time.perf_counter()
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                buffer += chunk
+                while len(buffer) >= self.block_size:
+                    await stage(bytes(buffer[:self.block_size]))
+                    del buffer[:self.block_size]
+            if buffer or not block_ids:
+                await stage(bytes(buffer))
+            await asyncio.gather(*pending)
+            await self._commit_blocks(name, block_ids, content_type)
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            BLOB_UPLOAD_SECONDS.observe(time.perf_counter() - start, "error")
+            raise
+        BLOB_UPLOAD_SECONDS.observe(time.perf_counter() - start, "ok")
+        BLOB_UPLOAD_BYTES.inc(amount=size)
+        return size
+
+    async def aclose(self):
+        pass
+
+
+class AzureBlobStore(BlobStore):
+    def __init__(self, connection_string: str, container: str, **kwargs):
+        super().__init__(**kwargs)
+        self.connection_string = connection_string
+        self.container = container
+        self._service = None
+
+    @property
+    def service(self):
+        # عميل واحد مشترك لكل الطلبات بدلاً من إنشائه في كل استدعاء
+        if self._service is None:
+            from azure.storage.blob.aio import BlobServiceClient
+            self._service = BlobServiceClient.from_connection_string(self.connection_string)
+        return self._service
+
+    def _blob(self, name: str):
+        return self.service.get_blob_client(container=self.container, blob=name)
+
+    def url(self, name: str) -> str:
+        return f"{self.service.url.rstrip('/')}/{self.container}/{name}"
+
+    async def _stage_block(self, name: str, block_id: str, data: bytes):
+        await self._blob(name).stage_block(block_id, data, length=len(data))
+
+    async def _commit_blocks(self, name: str, block_ids: List[str], content_type: str):
+        from azure.storage.blob import BlobBlock, ContentSettings
+        await self._blob(name).commit_block_list(
+            [BlobBlock(block_id=block_id) for block_id in block_ids],
+            content_settings=ContentSettings(content_type=content_type) if content_type else None,
+        )
+
+    async def aclose(self):
+        if self._service is not None:
+            await self._service.close()
+            self._service = None
+
+
+class InMemoryBlobStore(BlobStore):
+    """
+    مخزن وهمي داخل العملية بنفس واجهة AzureBlobStore، للاختبار وقياس الأداء
+    """
+
+    def __init__(self, container: str = "soundsaudi", base_url: str = "http://127.0.0.1:10000/devstoreaccount1",
+                 latency: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.container = container
+        self.base_url = base_url
+        self.latency = latency
+        self.staged: Dict[str, Dict[str, bytes]] = {}
+        self.blobs: Dict[str, bytes] = {}
+        self.content_types: Dict[str, str] = {}
+
+    def url(self, name: str) -> str:
+        return f"{self.base_url}/{self.container}/{name}"
+
+    async def _stage_block(self, name: str, block_id: str, data: bytes):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.staged.setdefault(name, {})[block_id] = data
+
+    async def _commit_blocks(self, name: str, block_ids: List[str], content_type: str):
+        staged = self.staged.pop(name, {})
+        self.blobs[name] = b"".join(staged[block_id] for block_id in block_ids)
+        self.content_types[name] = content_type
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+from sqlitedb import CacheDB
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(text: str) -> str:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class LRUCache:
+    """
+    ذاكرة LRU محدودة الحجم مع مدة صلاحية لكل عنصر، آمنة بين الخيوط
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, count: bool = True):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    if count:
+                        self.hits += 1
+                    return value
+                del self._entries[key]
+            if count:
+                self.misses += 1
+        return None
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ResponseCache:
+    """
+    ذاكرة مؤقتة للردود الحتمية: طبقة LRU في الذاكرة مع مدة صلاحية،
+    وطبقة اختيارية في SQLite تبقى بعد إعادة التشغيل وتُشارك بين العمليات.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 24 * 3600, db: Optional[CacheDB] = None):
+        self.ttl = ttl
+        self.db = db
+        self.memory = LRUCache(max_entries, ttl)
+        self.db_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(kind: str, prompt: str, **params) -> str:
+        payload = json.dumps({"kind": kind, "prompt": normalize_prompt(prompt), "params": params},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key, count=False)
+        if value is not None:
+            self.memory.hits += 1
+            return value
+        return self._get_db(key)
+
+    def _get_db(self, key: str) -> Optional[str]:
+        if self.db is not None:
+            now = time.time()
+            value = self.db.get_value(key, now)
+            if value is not None:
+                self.memory.set(key, value)
+                self.db_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: str):
+        self.memory.set(key, value)
+        if self.db is not None:
+            self.db.set_value(key, value, time.time() + self.ttl)
+
+    async def aget(self, key: str) -> Optional[str]:
+        """
+        get من داخل الـ event loop: الذاكرة تُقرأ مباشرة، وطبقة القاعدة في thread
+        """
+        value = self.memory.get(key, count=False)
+        if value is not None:
+            self.memory.hits += 1
+            return value
+        if self.db is None:
+            self.misses += 1
+            return None
+        return await asyncio.to_thread(self._get_db, key)
+
+    async def aset(self, key: str, value: str):
+        self.memory.set(key, value)
+        if self.db is not None:
+            await asyncio.to_thread(self.db.set_value, key, value, time.time() + self.ttl)
+
+    def stats(self):
+        hits = self.memory.hits + self.db_hits
+        lookups = hits + self.misses
+        return {
+            "size": len(self.memory),
+            "hits": hits,
+            "memory_hits": self.memory.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+        }
+
+
+class SessionCache:
+    """
+    ربط التوكن المشفّر بسجل الجلسة (SessionId, CompanyId, Token) لتفادي فك التشفير
+    وقراءة Sessions في كل طلب.
+
+    لا يُخزّن هنا رصيد الطلبات؛ الخصم يتم دائماً على القاعدة، فتبقى النتيجة صحيحة
+    مع عدة عمليات uvicorn. مدة الصلاحية القصيرة تحدّ من بقاء سجلات عدّلتها عمليات أخرى.
+    """
+
+    def __init__(self, max_entries: int = 50000, ttl: float = 60):
+        self.tokens = LRUCache(max_entries, ttl)
+        # رقم جيل لكل جلسة أُبطلت؛ السجلات المخزّنة بجيل أقدم تُهمل. الأرقام لا تتكرر، ويكفي أن يبقى
+        # الجيل مدة صلاحية السجلات (ttl) لأن كل سجل خُزّن قبل الإبطال ينتهي قبله
+        self._generations = LRUCache(max_entries, ttl)
+        self._counter = itertools.count(1)
+
+    def generation(self, session_id: str) -> int:
+        """
+        الجيل الحالي للجلسة؛ يُقرأ قبل قراءة السجل من القاعدة ويُمرَّر إلى set، فإذا أُبطلت الجلسة أثناء
+        القراءة لا يُخزَّن السجل القديم على أنه من الجيل الجديد
+        """
+        return self._generations.get(session_id, count=False) or 0
+
+    def get(self, token: str):
+        entry = self.tokens.get(token, count=False)
+        if entry is not None:
+            record, generation = entry
+            if self.generation(record[0]) == generation:
+                self.tokens.hits += 1
+                return record
+            self.tokens.pop(token)
+        self.tokens.misses += 1
+        return None
+
+    def set(self, token: str, record, generation: int):
+        self.tokens.set(token, (record, generation))
+
+    def invalidate_token(self, token: str):
+        self.tokens.pop(token)
+
+    def invalidate_session(self, session_id: str):
+        if len(self._generations) >= self._generations.max_entries and not self.generation(session_id):
+            # إخراج جيل قبل انتهاء صلاحيته قد يعيد تفعيل سجل أُبطل؛ إفراغ السجلات المخزّنة أسلم، وهو نادر
+            self.tokens.clear()
+        self._generations.set(session_id, next(self._counter))
+
+    def stats(self):
+        return self.tokens.stats()
@@ -1,21 +1,41 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from typing import List
+import asyncio
 import json
+import math
 import os
+import time
 import base64
 import os
 import uuid
-import requests
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-from azure.storage.blob import BlobServiceClient
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from sqlitedb import *
-from aes_cipher import AESCipher
+from aes_cipher import AESCipher, KeyRing
+from quota import QuotaEngine
+from upstream import UpstreamClient, UpstreamError
+from blob_store import AzureBlobStore, CONTENT_TYPES
+from cache import ResponseCache, SessionCache
+from singleflight import SingleFlight, scoped_key
+from ratelimit import RateLimiter, RateLimited
+from jobs import JobQueue, QueueFull
+from webhooks import Webhooks, WebhookRejected
+from audio import CONCATENABLE, concat_audio, split_sentences
+from usage import UsageMeter, UsageRecorder, add_usage, current_meter
+from logs import get_logger
+from metrics import REGISTRY, QUOTA_REJECTIONS
+
+logger = get_logger("lhja.api")
 
  
 class Options(BaseModel):
     text_deployment_name: str
     api_version: str  
     base_url: str 
+    use_cache: bool = True
    
 class Optionsspeech(BaseModel):
     speech_deployment_name: str
@@ -23,6 +43,8 @@ class Optionsspeech(BaseModel):
     base_url: str
     file_type:str="wav"
     voice: str = "alloy"
+    wait_for_upload: bool = True
+    use_cache: bool = True
 
    
 class CompanyCreate(BaseModel):
@@ -36,6 +58,10 @@ class CompanyUpdate(BaseModel):
     license_number:str
     employees:int
     services:str
+
+class CompanyBatchUpdate(CompanyUpdate):
+    company_id: str
+
 class SessionCreate(BaseModel):
     company_id: str
     token: str
@@ -45,26 +71,79 @@ class SessionCreate(BaseModel):
 
 class TextData(BaseModel):
     text: str
+
+class TextBatch(BaseModel):
+    texts: List[str]
+
+class BatchChat(BaseModel):
+    messages: List[str]
+    options: Options
+    max_parallel: int = 8
 class SessionUpdate(BaseModel):
     used_orders:int
  
 class EncryptionKeyRequest(BaseModel):
     encryption_key: str
 
+SessionRecord = namedtuple("SessionRecord", ["session_id", "company_id", "api_key"])
+
+
+class _GuardedStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse تُستدعى فيه on_close بعد انتهاء الإرسال مهما كان السبب: اكتمال البث، أو انقطاع
+    العميل قبل أن يبدأ المرور على المحتوى (فلا يصل التنفيذ إلى finally في المولّد)، أو خطأ في الإرسال
+    """
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.on_close()
+
 class UserHandler:
-    CONNECTION_STRING = "DefaultEndpointsProtocol=https;AccountName=lhjaspcev15204396534;AccountKey=vbGXAI8Fqix/bV15xFfkU3pzgs9wCav0IRy9Vv0gVjh0s3sAZV1oLi3NgMC6fG6MsvhMg7/VohUC+AStizl4zg==;EndpointSuffix=core.windows.net"
+    CONNECTION_STRING = os.environ.get("LHJA_BLOB_CONNECTION_STRING") or "DefaultEndpointsProtocol=https;AccountName=lhjaspcev15204396534;AccountKey=vbGXAI8Fqix/bV15xFfkU3pzgs9wCav0IRy9Vv0gVjh0s3sAZV1oLi3NgMC6fG6MsvhMg7/VohUC+AStizl4zg==;EndpointSuffix=core.windows.net"
     CONTAINER_NAME = "soundsaudi"
-    AZURE_TTS_ENDPOINT = "https://lahja-dev-resource.cognitiveservices.azure.com/openai/deployments/LAHJA-V1/audio/speech?api-version=2025-03-01-preview"
-    AZURE_CHAT_ENDPOINT = "https://lahja-dev-resource.cognitiveservices.azure.com/openai/deployments/gpt-4o/chat/completions?api-version=2025-01-01-preview"
-
-    def __init__(self):
+    AZURE_TTS_ENDPOINT = os.environ.get("LHJA_TTS_ENDPOINT", "https://lahja-dev-resource.cognitiveservices.azure.com/openai/deployments/LAHJA-V1/audio/speech?api-version=2025-03-01-preview")
+    MAX_BATCH_SIZE = 100
+    MAX_BATCH_PARALLELISM = 32
+    # النصوص الأطول من TTS_CHUNK_CHARS تُقسّم عند حدود الجمل وتُركَّب أجزاؤها بالتوازي
+    TTS_CHUNK_CHARS = 400
+    TTS_PARALLELISM = 4
+    USAGE_MAX_BUCKETS = {"hour": 24 * 31, "day": 366}
+    SYSTEM_PROMPT = "انت مساعد ذكي باللهجة النجدية السعودية."
+    AZURE_CHAT_ENDPOINT = os.environ.get("LHJA_CHAT_ENDPOINT", "https://lahja-dev-resource.cognitiveservices.azure.com/openai/deployments/gpt-4o/chat/completions?api-version=2025-01-01-preview")
+
+    def __init__(self, write_behind_quota: bool = False, upstream: UpstreamClient = None, blob_store=None,
+                 persistent_cache: bool = False, db_file: str = "LhjaAPIDb.db", rate_limiter: RateLimiter = None,
+                 shared_rate_limit: bool = False, job_workers: int = 4, job_queue_depth: int = 1000,
+                 webhooks: Webhooks = None):
         self.router = APIRouter()
        
-        self.db = CompanyDB("LhjaAPIDb.db")
-        self.db1 = SessionDB("LhjaAPIDb.db")
-        self.db1.add_session("5afce6c7-2e32-4aac-af90-4913c92c4707","4AwsIf87cyBIgaJVsy0phWUQdZFcbrJxpQBDQNzL4xjcP2MFzrrYJQQJ99BIACHYHv6XJ3w3AAAAACOGYrzM","Active",100,0)
-        self.db1.create_table()
-        self.cipher = AESCipher()
+        self.db = CompanyDB(db_file)
+        self.db1 = SessionDB(db_file)
+        # الخصم من الرصيد إما مباشرة في القاعدة أو عبر عداد الذاكرة ذي الكتابة المؤجلة
+        self.quota = QuotaEngine(self.db1).start() if write_behind_quota else self.db1
+        # بدون LHJA_AES_KEYRING أو LHJA_AES_KEYS يُولَّد مفتاح مؤقت خاص بهذه العملية
+        self.cipher = AESCipher(keyring=KeyRing.from_env())
+        self.upstream = upstream or UpstreamClient()
+        self.blob_store = blob_store or AzureBlobStore(self.CONNECTION_STRING, self.CONTAINER_NAME)
+        self._uploads = set()
+        self.cache = ResponseCache(db=CacheDB(db_file) if persistent_cache else None)
+        self.flights = SingleFlight()
+        self.sessions = SessionCache()
+        self.rate_limiter = rate_limiter or RateLimiter(db=RateLimitDB(db_file) if shared_rate_limit else None)
+        # مهام TTS غير المتزامنة: الرصيد يُحجز عند الإضافة ويُسوّى عند انتهاء المهمة
+        # عناوين الـ webhook تُتحقق عند الإضافة وعند الإرسال، والمحتوى موقّع بـ LHJA_WEBHOOK_SECRET
+        self.webhooks = webhooks or Webhooks.from_env()
+        self.jobs = JobQueue(JobDB(db_file), self.quota, self._run_job, self._deliver_webhook,
+                             workers=job_workers, max_depth=job_queue_depth)
+        # سجل الاستخدام لكل استدعاء مُحتسب، مع تجميع بالساعة واليوم للتقارير
+        self.usage = UsageRecorder(UsageDB(db_file))
+        REGISTRY.add_collector(self._collect_metrics)
         
         @self.router.post("/sessions/")
         def create_session(session: SessionCreate):
@@ -79,21 +158,40 @@ class UserHandler:
             return {"session_id": session_id, "message": "Session created successfully"}
 
          
+        @self.router.post("/sessions/batch")
+        def create_sessions(sessions: List[SessionCreate]):
+            results = self.db1.add_sessions([session.dict() for session in sessions])
+            return self._batch_results("session_id", results)
+
         @self.router.put("/sessions/{session_id}")
         def update_used_orders(session_id: str, session: SessionUpdate):
             if session.used_orders is None:
                 raise HTTPException(status_code=400, detail="used_orders required")
-            success = self.db1.update_used_orders(session_id, session.used_orders)
+            success = self.quota.update_used_orders(session_id, session.used_orders)
+            self.sessions.invalidate_session(session_id)
             if not success:
                 raise HTTPException(status_code=400, detail="Cannot update UsedOrders")
             return {"message": "UsedOrders updated successfully"}
 
+        @self.router.delete("/sessions/{session_id}")
+        def delete_session(session_id: str):
+            success = self.quota.delete_session(session_id)
+            self.sessions.invalidate_session(session_id)
+            if not success:
+                raise HTTPException(status_code=404, detail="Session not found")
+            return {"message": "Session deleted successfully"}
+
      
          
         @self.router.get("/sessions")
-        def get_all_sessions(): 
-            companies =self.db1.select("Sessions")
-            return {"Sessions": companies}
+        def get_all_sessions(limit: int = Query(1000, ge=1, le=10000), after: str = None, columns: str = None):
+            cols = self._columns(self.db1, columns)
+            sessions, next_after = self.db1.select_page("Sessions", self.db1.KEY_COLUMN, cols, limit, after)
+            return {"Sessions": sessions, "columns": cols, "next": next_after}
+
+        @self.router.get("/sessions/export")
+        def export_sessions(columns: str = None):
+            return self._export(self.db1, columns)
 
 
             return {"results": results}
@@ -116,6 +214,16 @@ class UserHandler:
             )
             return {"company_id": company_id, "message": "Company created successfully"}
 
+        @self.router.post("/companies/batch")
+        def create_companies(companies: List[CompanyCreate]):
+            results = self.db.add_companies([company.dict() for company in companies])
+            return self._batch_results("company_id", results)
+
+        @self.router.put("/companies/batch")
+        def update_companies(companies: List[CompanyBatchUpdate]):
+            results = self.db.update_companies([company.dict() for company in companies])
+            return self._batch_results("company_id", results, "updated")
+
         @self.router.put("/companies/{company_id}")
         def update_company(company_id: str, company: CompanyUpdate):
             success = self.db.update_company(company_id, company.dict(exclude_none=True))
@@ -133,129 +241,188 @@ class UserHandler:
             
         
         @self.router.get("/companies")
-        def get_all_companies():
-            companies =self.db.select("Company")
-            return {"companies": companies}
+        def get_all_companies(limit: int = Query(1000, ge=1, le=10000), after: str = None, columns: str = None):
+            cols = self._columns(self.db, columns)
+            companies, next_after = self.db.select_page("Company", self.db.KEY_COLUMN, cols, limit, after)
+            return {"companies": companies, "columns": cols, "next": next_after}
+
+        @self.router.get("/companies/{company_id}/sessions")
+        def get_company_sessions(company_id: str, active_only: bool = False, limit: int = Query(1000, ge=1, le=10000),
+                                 after: str = None, columns: str = None):
+            cols = self._columns(self.db1, columns)
+            sessions, next_after = self.db1.company_sessions(company_id, active_only, cols, limit, after)
+            return {"Sessions": sessions, "columns": cols, "next": next_after}
+
+        @self.router.get("/companies/export")
+        def export_companies(columns: str = None):
+            return self._export(self.db, columns)
         
         @self.router.post("/ChatText2Text2")
-        def chat_text2text2(message: str,Customize_the_dialect:str,token:str,options:Options):
-            
-            result = self.chat_with_gpt(message,token)
-            return {"response": result}
-        @self.router.post("/ChatText2Text3")
-        def chat_text2text3(message: str, Customize_the_dialect: str, token: str, options: Options):
- 
+        async def chat_text2text2(message: str,Customize_the_dialect:str,token:str,options:Options):
             try:
-                session_id = self.cipher.decrypt(token)
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Token decryption failed: {e}")
-
-          
-            key = self.db1.select(
-                "Sessions",
-                ["SessionId", "Token", "TotalOrders", "UsedOrders"],  
-                "SessionId=?",
-                (session_id,)
-            )
-
-            if not key:
-                raise HTTPException(status_code=404, detail="Session not found")
-            session_id, token, total_orders, used_orders = key[0]
-            remaining = total_orders - used_orders
-
-            if remaining <= 0:
-                 raise HTTPException(status_code=403, detail="No remaining orders. Please upgrade your plan.")
-            result = self.chat_with_gpt(message, token)
+                result = await self.chat_with_gpt(message,token)
+            except UpstreamError as e:
+                raise HTTPException(status_code=502, detail=str(e))
+            return {"response": result}
 
- 
-            self.db1.update_used_orders(session_id, used_orders + 1)
+        @self.router.post("/ChatText2Text3")
+        async def chat_text2text3(message: str, Customize_the_dialect: str, token: str, options: Options, stream: bool = False):
+            session = await self._authorize_async(token)
+            with await self._admit(session) as lease, self._metered(session, "/ChatText2Text3") as meter:
+                reservation = await asyncio.to_thread(self._reserve, session.session_id)
+                if stream:
+                    return await self._stream_chat(reservation, message, session.api_key, Customize_the_dialect,
+                                                   options.use_cache, lease.transfer(), session, "/ChatText2Text3", meter)
+                try:
+                    async with reservation:
+                        result = await self.chat(message, session.api_key, Customize_the_dialect, options.use_cache)
+                except UpstreamError as e:
+                    raise HTTPException(status_code=502, detail=str(e))
+                meter.orders = reservation.n
 
             return {
-                   
-                    "RemainingOrders": remaining - 1,
+                    "RemainingOrders": reservation.remaining,
                     "Response": result
                 }
 
-
-         
         @self.router.post("/T2T")
-        def text2text(message: str, Customize_the_dialect: str, token: str, options: Options):
- 
-            try:
-                session_id = self.cipher.decrypt(token)
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Token decryption failed: {e}")
-
-          
-            key = self.db1.select(
-                "Sessions",
-                ["SessionId", "Token", "TotalOrders", "UsedOrders"],  
-                "SessionId=?",
-                (session_id,)
-            )
-
-            if not key:
-                raise HTTPException(status_code=404, detail="Session not found")
-            session_id, token, total_orders, used_orders = key[0]
-            remaining = total_orders - used_orders
-
-            if remaining <= 0:
-                 raise HTTPException(status_code=403, detail="No remaining orders. Please upgrade your plan.")
-            result = self.chat_with_gpt(message, token)
-
- 
-            self.db1.update_used_orders(session_id, used_orders + 1)
+        async def text2text(message: str, Customize_the_dialect: str, token: str, options: Options, stream: bool = False):
+            session = await self._authorize_async(token)
+            with await self._admit(session) as lease, self._metered(session, "/T2T") as meter:
+                reservation = await asyncio.to_thread(self._reserve, session.session_id)
+                if stream:
+                    return await self._stream_chat(reservation, message, session.api_key, Customize_the_dialect,
+                                                   options.use_cache, lease.transfer(), session, "/T2T", meter)
+                try:
+                    async with reservation:
+                        result = await self.chat(message, session.api_key, Customize_the_dialect, options.use_cache)
+                except UpstreamError as e:
+                    raise HTTPException(status_code=502, detail=str(e))
+                meter.orders = reservation.n
 
             return {
-                   
-                    "RemainingOrders": remaining - 1,
+                    "RemainingOrders": reservation.remaining,
                     "Response": result
                 }
 
-        @self.router.post("/ChatText2Speech")
-        
-        def chat_text2speech(text: str,Customize_the_dialect:str,token: str, Optionsspeech:Optionsspeech):
-            try:
-                session_id = self.cipher.decrypt(token)
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Token decryption failed: {e}")
-
-          
-            key = self.db1.select(
-                "Sessions",
-                ["SessionId", "Token", "TotalOrders", "UsedOrders"],  
-                "SessionId=?",
-                (session_id,)
-            )
+        @self.router.post("/T2T/batch")
+        async def text2text_batch(Customize_the_dialect: str, token: str, batch: BatchChat):
+            if not batch.messages:
+                raise HTTPException(status_code=400, detail="messages required")
+            if len(batch.messages) > self.MAX_BATCH_SIZE:
+                raise HTTPException(status_code=400, detail=f"At most {self.MAX_BATCH_SIZE} messages per batch")
+            session = await self._authorize_async(token)
+            with await self._admit(session, len(batch.messages)), self._metered(session, "/T2T/batch") as meter:
+                # حجز رصيد الدفعة كاملة بخطوة واحدة، ثم إعادة ما فشل منها
+                reservation = await asyncio.to_thread(self._reserve, session.session_id, len(batch.messages))
+                async with reservation:
+                    results = await self.chat_many(batch.messages, session.api_key, Customize_the_dialect,
+                                                   batch.options.use_cache, batch.max_parallel)
+                    await reservation.arefund(sum(1 for item in results if item["error"] is not None))
+                meter.orders = reservation.n
 
-            if not key:
-                raise HTTPException(status_code=404, detail="Session not found")
-            session_id, token, total_orders, used_orders = key[0]
-            remaining = total_orders - used_orders
+            return {
+                    "RemainingOrders": reservation.remaining,
+                    "Responses": results
+                }
 
-            if remaining <= 0:
-                 raise HTTPException(status_code=403, detail="No remaining orders. Please upgrade your plan.")
-            result = self.chat_with_gpt(text, key)
-            url = self.text_to_speech_and_upload(result, token, Optionsspeech.file_type,Optionsspeech.voice)
+        @self.router.get("/cache/stats")
+        def cache_stats():
+            return {**self.cache.stats(), "single_flight": self.flights.stats(), "sessions": self.sessions.stats(),
+                    "rate_limit": self.rate_limiter.stats()}
 
- 
-            self.db1.update_used_orders(session_id, used_orders + 1)
+        @self.router.post("/ChatText2Speech")
+        async def chat_text2speech(text: str,Customize_the_dialect:str,token: str, Optionsspeech:Optionsspeech,
+                                   async_job: bool = False, webhook_url: str = None):
+            if webhook_url:
+                try:
+                    await self.webhooks.validate(webhook_url)
+                except WebhookRejected as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+            session = await self._authorize_async(token)
+            if async_job:
+                # الاستخدام يُسجَّل عند تنفيذ المهمة (_run_job) لا عند إضافتها
+                with await self._admit(session), self._database_errors():
+                    reservation = await asyncio.to_thread(self._reserve, session.session_id)
+                    return await self._enqueue_speech(session, reservation, text, Customize_the_dialect,
+                                                      Optionsspeech, webhook_url)
+            with await self._admit(session), self._metered(session, "/ChatText2Speech") as meter:
+                reservation = await asyncio.to_thread(self._reserve, session.session_id)
+                try:
+                    async with reservation:
+                        url = await self.speech(text, session.api_key, Customize_the_dialect, Optionsspeech)
+                except UpstreamError as e:
+                    raise HTTPException(status_code=502, detail=str(e))
+                meter.orders = reservation.n
 
             return {
-                    
-                    "RemainingOrders": remaining - 1,
+                    "RemainingOrders": reservation.remaining,
                     "Response":url
                 }
-  
-             
-            
-         
-        
+
+        @self.router.get("/usage")
+        def usage_report(token: str, granularity: str = "hour", start: str = None, end: str = None,
+                         scope: str = "company"):
+            """
+            تقرير الاستخدام لشركة الجلسة (أو للجلسة نفسها مع scope=session) من جداول التجميع،
+            لكل فترة (ساعة أو يوم) ولكل endpoint. start و end بصيغة ISO 8601 (UTC إن لم تُحدد المنطقة)
+            """
+            if granularity not in self.USAGE_MAX_BUCKETS:
+                raise HTTPException(status_code=400, detail="granularity must be 'hour' or 'day'")
+            if scope not in ("company", "session"):
+                raise HTTPException(status_code=400, detail="scope must be 'company' or 'session'")
+            session = self._authorize(token)
+            seconds = UsageDB.ROLLUP_SECONDS[granularity]
+            end_ts = self._parse_time(end) if end else time.time()
+            start_ts = self._parse_time(start) if start else end_ts - 24 * seconds
+            if not start_ts < end_ts or (end_ts - start_ts) / seconds > self.USAGE_MAX_BUCKETS[granularity]:
+                raise HTTPException(status_code=400, detail=f"At most {self.USAGE_MAX_BUCKETS[granularity]} "
+                                                            f"{granularity} buckets per report")
+            # تقريب البداية لأول الفترة حتى تُحتسب الفترة الجزئية كاملة
+            start_bucket = int(start_ts // seconds * seconds)
+            rows = self.usage.db.usage_report(session.company_id, granularity, start_bucket, end_ts,
+                                              session.session_id if scope == "session" else None)
+            return {
+                    "CompanyId": session.company_id,
+                    "Granularity": granularity,
+                    "Usage": [{
+                        "bucket": datetime.fromtimestamp(bucket, timezone.utc).isoformat(),
+                        "endpoint": endpoint,
+                        "calls": calls,
+                        "errors": errors,
+                        "orders": orders,
+                        "avg_latency_ms": round(latency_sum / calls, 3) if calls else None,
+                        "max_latency_ms": round(latency_max, 3),
+                        "input_tokens": input_tokens,
+                        "output_tokens": output_tokens,
+                        "bytes": nbytes,
+                    } for bucket, endpoint, calls, errors, orders, latency_sum, latency_max, input_tokens,
+                          output_tokens, nbytes in rows]
+                }
+
+        @self.router.get("/jobs/{job_id}")
+        def job_status(job_id: str, token: str):
+            session = self._authorize(token)
+            job = self.jobs.db.get_job(job_id)
+            if job is None or job[1] != session.session_id:
+                raise HTTPException(status_code=404, detail="Job not found")
+            _, _, kind, status, result, error, created_at, updated_at = job
+            return {
+                    "JobId": job_id,
+                    "Kind": kind,
+                    "Status": status,
+                    "Response": json.loads(result) if result else None,
+                    "Error": error,
+                    "CreatedAt": created_at,
+                    "UpdatedAt": updated_at
+                }
+
         @self.router.post("/encrypt")
         def encrypt_text(data: TextData):
+            # المفتاح نفسه لا يُرجع أبداً: مع keyring مشترك يفك كل التوكنات على كل الخوادم.
+            # تدوير المفاتيح من سطر الأوامر فقط (python aes_cipher.py rotate)
             encrypted =self.cipher.encrypt(data.text)
-            key_b64 = AESCipher.key_to_base64(self.cipher.key)
-            return {"encrypted": encrypted, "key": key_b64}
+            return {"encrypted": encrypted, "key_id": self.cipher.key_id}
         
         @self.router.post("/decrypt")
         def decrypt_text(data: TextData):
@@ -264,31 +431,521 @@ class UserHandler:
                 return {"decrypted": decrypted}
             except Exception as e:
                 return {"error": str(e)}
+
+        @self.router.post("/encrypt/batch")
+        def encrypt_batch(data: TextBatch):
+            return {"encrypted": self.cipher.encrypt_many(data.texts)}
+
+        @self.router.post("/decrypt/batch")
+        def decrypt_batch(data: TextBatch):
+            decrypted = self.cipher.decrypt_many(data.texts)
+            errors = [i for i, value in enumerate(decrypted) if value is None]
+            return {"decrypted": decrypted, "errors": errors}
+
+        @self.router.post("/encrypt/batch/raw")
+        async def encrypt_batch_raw(request: Request):
+            """
+            وضع البايتات الخام للخدمات الداخلية: الطلب والرد إطارات (طول 4 بايت + قيمة) بدون base64
+            """
+            frames = self._frames(await request.body())
+            encrypted = self.cipher.encrypt_many(frames, raw=True)
+            return Response(AESCipher.pack_frames(encrypted), media_type="application/octet-stream")
+
+        @self.router.post("/decrypt/batch/raw")
+        async def decrypt_batch_raw(request: Request):
+            frames = self._frames(await request.body())
+            decrypted = self.cipher.decrypt_many(frames, raw=True)
+            return Response(AESCipher.pack_frames(decrypted), media_type="application/octet-stream")
     
 
-    def chat_with_gpt(self, text: str, api_key: str):
+    @staticmethod
+    def _batch_results(id_field: str, results, done_field: str = "created"):
+        items = [{id_field: item_id, "error": error} for item_id, error in results]
+        done = sum(1 for _, error in results if error is None)
+        return {done_field: done, "failed": len(items) - done, "results": items}
+
+    @staticmethod
+    def _frames(body: bytes):
+        try:
+            frames = AESCipher.unpack_frames(body)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid frame payload: {e}")
+        # FAILED_FRAME (0xFFFFFFFF) علامة فشل عنصر في الرد فقط، وليست قيمة صالحة في الطلب
+        if any(frame is None for frame in frames):
+            raise HTTPException(status_code=400, detail="Invalid frame payload: failed-item marker in request")
+        return frames
+
+    @staticmethod
+    def _columns(db, columns: str = None):
+        if not columns:
+            return list(db.COLUMNS)
+        cols = [c.strip() for c in columns.split(",") if c.strip()]
+        unknown = [c for c in cols if c not in db.COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
+        return cols
+
+    def _export(self, db, columns: str = None, chunk_size: int = 1000):
+        """
+        تصدير الجدول كاملاً بصيغة NDJSON على دفعات، فيبقى استهلاك الذاكرة ثابتاً مهما كبر الجدول
+        """
+        cols = self._columns(db, columns)
+
+        def lines():
+            for row in db.iter_select(db.TABLE_NAME, db.KEY_COLUMN, cols, chunk_size):
+                yield json.dumps(dict(zip(cols, row)), ensure_ascii=False) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    def _authorize(self, token: str):
+        """
+        تحويل التوكن المشفّر إلى سجل الجلسة، مع تخزين النتيجة لتفادي فك التشفير وقراءة القاعدة في كل طلب
+        """
+        session = self.sessions.get(token)
+        if session is not None:
+            return session
+        try:
+            session_id = self.cipher.decrypt(token)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Token decryption failed: {e}")
+
+        generation = self.sessions.generation(session_id)
+        key = self.db1.select(
+            "Sessions",
+            ["SessionId", "CompanyId", "Token"],
+            "SessionId=?",
+            (session_id,)
+        )
+        if not key:
+            raise HTTPException(status_code=404, detail="Session not found")
+        session = SessionRecord(*key[0])
+        self.sessions.set(token, session, generation)
+        return session
+
+    async def _authorize_async(self, token: str):
+        """
+        _authorize للـ endpoints غير المتزامنة: فك التشفير وقراءة القاعدة عند عدم وجود التوكن في الذاكرة
+        تتمان في thread حتى لا يتوقف الـ event loop
+        """
+        session = self.sessions.get(token)
+        if session is not None:
+            return session
+        return await asyncio.to_thread(self._authorize, token)
+
+    def setup(self):
+        """
+        إنشاء الجداول والفهارس عند بدء التطبيق (startup). كل العبارات IF NOT EXISTS فتكرار الاستدعاء آمن،
+        ولا يُكتب أي صف أثناء الإقلاع
+        """
+        for db in (self.db, self.db1, self.cache.db, self.rate_limiter.db, self.jobs.db, self.usage.db):
+            if db is not None:
+                db.create_table()
+        self.usage.start()
+
+    async def start(self):
+        """
+        تشغيل عمال المهام غير المتزامنة واستئناف ما لم يكتمل قبل إعادة التشغيل (بعد setup)
+        """
+        await self.jobs.start()
+
+    @contextmanager
+    def _metered(self, session: SessionRecord, endpoint: str):
+        """
+        قياس الاستدعاء وتسجيله في سجل الاستخدام عند انتهائه، مع حالته (200 أو رمز الخطأ)
+        """
+        meter = UsageMeter()
+        token = current_meter.set(meter)
+        status = 200
+        try:
+            with self._database_errors():
+                yield meter
+        except HTTPException as e:
+            status = e.status_code
+            raise
+        except Exception:
+            status = 500
+            raise
+        finally:
+            current_meter.reset(token)
+            if not meter.deferred:
+                self.usage.record(session.session_id, session.company_id, endpoint, status, meter)
+
+    @staticmethod
+    def _parse_time(value: str) -> float:
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid ISO 8601 time: {value}")
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+    async def _enqueue_speech(self, session: SessionRecord, reservation, text: str, dialect: str,
+                              options: Optionsspeech, webhook_url: str = None):
+        payload = {"text": text, "dialect": dialect, "options": options.dict(), "orders": reservation.n}
+        try:
+            job_id = await self.jobs.submit(session.session_id, "speech", payload, reservation, webhook_url)
+        except QueueFull as e:
+            await reservation.arefund()
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+        except Exception:
+            await reservation.arefund()
+            raise
+        return JSONResponse(status_code=202, content={
+                "RemainingOrders": reservation.remaining,
+                "JobId": job_id,
+                "Status": "queued"
+            })
+
+    async def _run_job(self, kind: str, session_id: str, payload: dict):
+        # مفتاح الخدمة لا يُحفظ مع المهمة، بل يُقرأ من الجلسة عند التنفيذ
+        rows = await asyncio.to_thread(self.db1.select, "Sessions", ["Token", "CompanyId"], "SessionId=?",
+                                       (session_id,))
+        if not rows:
+            raise RuntimeError("Session not found")
+        if kind != "speech":
+            raise RuntimeError(f"Unknown job kind: {kind}")
+        api_key, company_id = rows[0]
+        options = Optionsspeech(**payload["options"])
+        # المهمة لا تكتمل قبل اكتمال رفع الملف
+        options.wait_for_upload = True
+        with self._metered(SessionRecord(session_id, company_id, api_key), f"job:{kind}") as meter:
+            url = await self.speech(payload["text"], api_key, payload["dialect"], options)
+            meter.orders = payload.get("orders", 1)
+        return url
+
+    async def _deliver_webhook(self, url: str, body: dict):
+        # قد يكون اسم المضيف قد أُعيد توجيهه إلى عنوان داخلي منذ إضافة المهمة
+        await self.webhooks.validate(url)
+        content = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json", **self.webhooks.sign(content)}
+        response = await self.upstream.post(url, json=None, headers=headers, service="webhook", content=content)
+        if response.status_code >= 400:
+            raise UpstreamError(f"Webhook returned {response.status_code}")
+
+    async def _admit(self, session: SessionRecord, n: int = 1):
+        """
+        قبول الطلب في حدّ المعدل؛ الدلاء المشتركة (RateLimitDB) تُحدَّث في thread
+        """
+        try:
+            if self.rate_limiter.db is None:
+                return self.rate_limiter.acquire(session.session_id, session.company_id, n)
+            return await asyncio.to_thread(self.rate_limiter.acquire, session.session_id, session.company_id, n)
+        except RateLimited as e:
+            QUOTA_REJECTIONS.inc("rate_limited")
+            raise HTTPException(status_code=429, detail=e.reason,
+                                headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+
+    def _reserve(self, session_id: str, n: int = 1):
+        with self._database_errors():
+            reservation = self.quota.reserve_orders(session_id, n)
+            # قد يكون السجل المخزّن قديماً (حُذفت الجلسة من عملية أخرى)
+            exists = reservation is not None or self.db1.select("Sessions", ["SessionId"], "SessionId=?",
+                                                                (session_id,), strict=True)
+        if not exists:
+            self.sessions.invalidate_session(session_id)
+            raise HTTPException(status_code=404, detail="Session not found")
+        if reservation is None:
+            QUOTA_REJECTIONS.inc("exhausted")
+            raise HTTPException(status_code=403, detail="No remaining orders. Please upgrade your plan.")
+        return reservation
+
+    @staticmethod
+    @contextmanager
+    def _database_errors():
+        """
+        تعذّر الوصول للقاعدة أثناء الخصم أو الإعادة خطأ مؤقت (503)، لا نفاد رصيد ولا جلسة مفقودة
+        """
+        try:
+            yield
+        except DatabaseUnavailable as e:
+            raise HTTPException(status_code=503, detail="Database unavailable, please retry",
+                                headers={"Retry-After": "1"}) from e
+
+    async def _stream_chat(self, reservation, message: str, api_key: str, dialect: str = "", use_cache: bool = True,
+                           lease=None, session: SessionRecord = None, endpoint: str = None, meter: UsageMeter = None):
+        """
+        بث الرد عبر Server-Sent Events. يُعاد الطلب للرصيد إذا فشلت الخدمة قبل أول جزء أو أثناء البث،
+        ويُعتمد الخصم عند اكتمال البث أو انقطاع اتصال العميل
+        """
+        key = self._chat_cache_key(message, dialect)
+        cached = await self.cache.aget(key) if use_cache else None
+        chunks = self._replay(cached) if cached is not None else self.stream_chat_with_gpt(message, api_key, meter)
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except UpstreamError as e:
+            if lease is not None:
+                lease.release()
+            await reservation.arefund()
+            raise HTTPException(status_code=502, detail=str(e))
+        except BaseException:
+            if lease is not None:
+                lease.release()
+            await reservation.arefund()
+            raise
+
+        if meter is not None:
+            # البث يكمل بعد انتهاء الدالة، فيُسجَّل الاستخدام عند انتهائه
+            meter.deferred = True
+
+        finished = False
+
+        async def finish(status: int = 200):
+            # تُستدعى من نهاية البث ومن _GuardedStreamingResponse، فتعمل مرة واحدة حتى لو لم يبدأ البث أصلاً
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            reservation.commit()
+            if lease is not None:
+                lease.release()
+            if meter is not None:
+                meter.orders = reservation.n
+                self.usage.record(session.session_id, session.company_id, endpoint, status, meter)
+            await chunks.aclose()
+
+        async def events():
+            parts = []
+            status = 200
+            try:
+                if first is not None:
+                    parts.append(first)
+                    yield f"data: {json.dumps({'delta': first}, ensure_ascii=False)}\n\n"
+                    async for delta in chunks:
+                        parts.append(delta)
+                        yield f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n"
+                if use_cache and cached is None:
+                    await self.cache.aset(key, "".join(parts))
+                yield f"event: done\ndata: {json.dumps({'RemainingOrders': reservation.remaining})}\n\n"
+            except UpstreamError as e:
+                # انقطاع الخدمة أثناء البث لا يُحتسب على العميل
+                status = 502
+                await reservation.arefund()
+                yield f"event: error\ndata: {json.dumps({'detail': str(e)}, ensure_ascii=False)}\n\n"
+            finally:
+                await finish(status)
+
+        return _GuardedStreamingResponse(events(), finish, media_type="text/event-stream",
+                                         headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @staticmethod
+    async def _replay(value: str):
+        yield value
+
+    def _chat_params(self):
+        return {"max_tokens": 512, "temperature": 0.8, "top_p": 1, "model": "gpt-4o"}
+
+    def _chat_request(self, text: str, api_key: str, stream: bool = False):
         headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
-        messages = [{"role": "system", "content": "انت مساعد ذكي باللهجة النجدية السعودية."},
+        messages = [{"role": "system", "content": self.SYSTEM_PROMPT},
                     {"role": "user", "content": text}]
-        data = {"messages": messages, "max_tokens": 512, "temperature": 0.8, "top_p": 1, "model": "gpt-4o"}
-        response = requests.post(self.AZURE_CHAT_ENDPOINT, json=data, headers=headers)
+        data = {"messages": messages, **self._chat_params()}
+        if stream:
+            data["stream"] = True
+            data["stream_options"] = {"include_usage": True}
+        return data, headers
+
+    def _chat_cache_key(self, text: str, dialect: str) -> str:
+        return ResponseCache.make_key("chat", text, dialect=dialect, system=self.SYSTEM_PROMPT, **self._chat_params())
+
+    async def chat(self, text: str, api_key: str, dialect: str = "", use_cache: bool = True):
+        """
+        chat_with_gpt مع الذاكرة المؤقتة للردود المتكررة، ودمج الطلبات المتطابقة الجارية في استدعاء واحد
+        """
+        if not use_cache:
+            return await self.chat_with_gpt(text, api_key)
+        key = self._chat_cache_key(text, dialect)
+        cached = await self.cache.aget(key)
+        if cached is not None:
+            return cached
+        return await self.flights.do(scoped_key(key, api_key), lambda: self._chat_and_store(key, text, api_key))
+
+    async def _chat_and_store(self, key: str, text: str, api_key: str):
+        result = await self.chat_with_gpt(text, api_key)
+        await self.cache.aset(key, result)
+        return result
+
+    async def chat_many(self, messages: List[str], api_key: str, dialect: str = "", use_cache: bool = True,
+                        max_parallel: int = 8):
+        """
+        تنفيذ عدة رسائل بالتوازي بحد أقصى max_parallel، مع إرجاع النتائج بنفس الترتيب وخطأ لكل عنصر
+        """
+        semaphore = asyncio.Semaphore(max(1, min(max_parallel, self.MAX_BATCH_PARALLELISM)))
+
+        async def run(index: int, message: str):
+            async with semaphore:
+                try:
+                    response = await self.chat(message, api_key, dialect, use_cache)
+                    return {"index": index, "response": response, "error": None}
+                except UpstreamError as e:
+                    return {"index": index, "response": None, "error": str(e)}
+
+        return await asyncio.gather(*(run(i, message) for i, message in enumerate(messages)))
+
+    async def speech(self, text: str, api_key: str, dialect: str, options: Optionsspeech):
+        """
+        محادثة ثم تحويل إلى كلام، مع إرجاع رابط الملف المرفوع سابقاً عند تكرار نفس الطلب
+        """
+        key = ResponseCache.make_key("speech", text, dialect=dialect, system=self.SYSTEM_PROMPT,
+                                     voice=options.voice, file_type=options.file_type, **self._chat_params())
+        if not options.use_cache:
+            return await self._speech_and_store(None, text, api_key, dialect, options)
+        cached = await self.cache.aget(key)
+        if cached is not None:
+            return cached
+        return await self.flights.do(scoped_key(key, api_key),
+                                     lambda: self._speech_and_store(key, text, api_key, dialect, options))
+
+    async def _speech_and_store(self, key, text: str, api_key: str, dialect: str, options: Optionsspeech):
+        result = await self.chat(text, api_key, dialect, options.use_cache)
+        return await self.text_to_speech_and_upload(result, api_key, options.file_type, options.voice,
+                                                     wait_for_upload=options.wait_for_upload, cache_key=key)
+
+    async def stream_chat_with_gpt(self, text: str, api_key: str, meter: UsageMeter = None):
+        data, headers = self._chat_request(text, api_key, stream=True)
+        async for line in self.upstream.stream_lines(self.AZURE_CHAT_ENDPOINT, json=data, headers=headers,
+                                                   service="chat_stream"):
+            if not line.startswith("data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == "[DONE]":
+                break
+            body = json.loads(payload)
+            if body.get("usage"):
+                # آخر جزء (stream_options.include_usage) يحمل عدد الـ tokens ولا يحمل نصاً
+                add_usage(body["usage"].get("prompt_tokens"), body["usage"].get("completion_tokens"), meter=meter)
+            choices = body.get("choices") or []
+            delta = choices[0].get("delta", {}).get("content") if choices else None
+            if delta:
+                yield delta
+
+    async def chat_with_gpt(self, text: str, api_key: str):
+        data, headers = self._chat_request(text, api_key)
+        response = await self.upstream.post(self.AZURE_CHAT_ENDPOINT, json=data, headers=headers, service="chat")
         if response.status_code == 200:
-            return response.json()["choices"][0]["message"]["content"]
-        return f"Error: {response.status_code}\n{response.text}"
-
-    def text_to_speech_and_upload(self, text, api_key, file_type="wav", voice="alloy", speed=1.0):
+            body = response.json()
+            usage = body.get("usage") or {}
+            add_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+            return body["choices"][0]["message"]["content"]
+        raise UpstreamError(f"Error: {response.status_code}\n{response.text}")
+
+    async def text_to_speech_and_upload(self, text, api_key, file_type="wav", voice="alloy", speed=1.0, wait_for_upload=True,
+                                        cache_key=None):
+        """
+        بث الصوت من خدمة TTS مباشرة إلى Blob على شكل كتل، دون تحميل الملف كاملاً في الذاكرة.
+        النص الطويل يُقسّم إلى جمل تُركَّب بالتوازي ثم تُدمج في ملف واحد (synthesize_chunks).
+        عند wait_for_upload=False يُرجع الرابط بعد بدء الرفع وقبل اكتماله
+        """
         headers = {"Content-Type": "application/json", "api-key": api_key}
-        data = {"model": "LAHJA-V1", "input": text, "voice": voice, "speed": speed}
-        response = requests.post(self.AZURE_TTS_ENDPOINT, json=data, headers=headers)
-        if response.status_code != 200:
-            return {"error": response.text}
-        audio_data = response.content
-        unique_id = uuid.uuid4().hex
-        filename = f"{unique_id}.{file_type}"
-        blob_service_client = BlobServiceClient.from_connection_string(self.CONNECTION_STRING)
-        blob_client = blob_service_client.get_blob_client(container=self.CONTAINER_NAME, blob=filename)
-        blob_client.upload_blob(audio_data, overwrite=True)
-        return f"https://{blob_service_client.account_name}.blob.core.windows.net/{self.CONTAINER_NAME}/{filename}"
+        parts = split_sentences(text, self.TTS_CHUNK_CHARS) if file_type in CONCATENABLE else [text]
+        if len(parts) > 1:
+            merged = await self.synthesize_chunks(parts, headers, file_type, voice, speed)
+
+            async def audio():
+                yield merged
+        else:
+            data = self._tts_request(text, file_type, voice, speed)
+            chunks = self.upstream.stream_bytes(self.AZURE_TTS_ENDPOINT, json=data, headers=headers, service="tts")
+            # انتظار أول جزء للتأكد من نجاح خدمة TTS قبل بدء الرفع
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                raise UpstreamError("Error: empty audio response")
+
+            async def audio():
+                yield first
+                async for chunk in chunks:
+                    yield chunk
+
+        filename = f"{uuid.uuid4().hex}.{file_type}"
+        url = self.blob_store.url(filename)
+
+        async def upload():
+            size = await self.blob_store.upload_stream(filename, audio(), CONTENT_TYPES.get(file_type))
+            add_usage(nbytes=size)
+            # لا يُخزّن الرابط إلا بعد اكتمال الرفع
+            if cache_key is not None:
+                await self.cache.aset(cache_key, url)
+
+        if wait_for_upload:
+            await upload()
+        else:
+            task = asyncio.ensure_future(upload())
+            self._uploads.add(task)
+            task.add_done_callback(self._upload_done)
+        return url
+
+    @staticmethod
+    def _tts_request(text: str, file_type: str, voice: str, speed: float):
+        return {"model": "LAHJA-V1", "input": text, "voice": voice, "speed": speed, "response_format": file_type}
+
+    async def synthesize_chunks(self, parts: List[str], headers, file_type: str = "wav", voice: str = "alloy",
+                                speed: float = 1.0) -> bytes:
+        """
+        تركيب الأجزاء بالتوازي (بحد TTS_PARALLELISM) ودمجها بالترتيب، فيقترب الزمن الكلي من زمن أبطأ جزء
+        """
+        semaphore = asyncio.Semaphore(self.TTS_PARALLELISM)
+
+        async def synthesize(part: str) -> bytes:
+            async with semaphore:
+                data = self._tts_request(part, file_type, voice, speed)
+                response = await self.upstream.post(self.AZURE_TTS_ENDPOINT, json=data, headers=headers, service="tts")
+            if response.status_code != 200:
+                raise UpstreamError(f"Error: {response.status_code}\n{response.text}")
+            if not response.content:
+                raise UpstreamError("Error: empty audio response")
+            return response.content
+
+        tasks = [asyncio.ensure_future(synthesize(part)) for part in parts]
+        try:
+            segments = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        try:
+            return concat_audio(segments, file_type)
+        except ValueError as e:
+            raise UpstreamError(f"Error: cannot merge audio segments: {e}")
+
+    def _upload_done(self, task):
+        self._uploads.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            error = task.exception()
+            logger.error("Error uploading audio: %s", error, exc_info=(type(error), error, error.__traceback__))
+
+    def _collect_metrics(self):
+        cache = self.cache.stats()
+        sessions = self.sessions.stats()
+        flights = self.flights.stats()
+        limiter = self.rate_limiter.stats()
+        usage = self.usage.stats()
+        return [
+            ("lhja_cache_hit_ratio", "Response cache hit ratio since start.", {"cache": "response"}, cache["hit_ratio"]),
+            ("lhja_cache_hit_ratio", "Response cache hit ratio since start.", {"cache": "session"}, sessions["hit_ratio"]),
+            ("lhja_cache_entries", "Entries held in memory.", {"cache": "response"}, cache["size"]),
+            ("lhja_cache_entries", "Entries held in memory.", {"cache": "session"}, sessions["size"]),
+            ("lhja_singleflight_coalesced", "Calls served by an identical in-flight call.", {}, flights["coalesced"]),
+            ("lhja_in_flight_requests", "Metered requests currently admitted.", {}, limiter["in_flight"]),
+            ("lhja_pending_uploads", "Background blob uploads not yet finished.", {}, len(self._uploads)),
+            ("lhja_job_queue_depth", "Async jobs waiting for a worker.", {}, self.jobs.depth),
+            ("lhja_job_workers_busy", "Async job workers currently running a job.", {}, self.jobs.busy),
+            ("lhja_usage_buffered", "Usage records waiting to be written.", {}, usage["buffered"]),
+            ("lhja_usage_dropped", "Usage records dropped while the database was unavailable.", {}, usage["dropped"]),
+        ]
+
+    async def aclose(self):
+        REGISTRY.remove_collector(self._collect_metrics)
+        await self.jobs.aclose()
+        self.usage.close()
+        if self._uploads:
+            await asyncio.gather(*self._uploads, return_exceptions=True)
+        await self.upstream.aclose()
+        await self.blob_store.aclose()
+        if isinstance(self.quota, QuotaEngine):
+            self.quota.close()
 
     def get_router(self):
         return self.router
@@ -0,0 +1,53 @@
+"""
+واجهة Gradio التجريبية، تُحمَّل عند أول طلب إلى مسارها بدلاً من وقت الإقلاع.
+
+استيراد gradio وحده يستغرق ثوانٍ، وأغلب النسخ لا تُطلب منها الواجهة أبداً.
+"""
+import asyncio
+
+from fastapi import FastAPI
+
+
+def greet(name):
+    return f"مرحباً {name}! 👋"
+
+
+def build_gradio_app() -> FastAPI:
+    import gradio as gr
+
+    gradio_app = gr.Interface(fn=greet, inputs="text", outputs="text", title="Gradio Demo")
+    return gr.mount_gradio_app(FastAPI(), gradio_app, path="/")
+
+
+class LazyGradio:
+    """
+    تطبيق ASGI يُركّب على /gradio ولا يستورد gradio إلا عند أول طلب.
+
+    البناء يتم في thread حتى لا يتوقف الـ event loop أثناء الاستيراد، ويُشغّل lifespan
+    التطبيق الداخلي يدوياً لأن التطبيقات المركّبة لا تتلقى أحداث startup/shutdown.
+    """
+
+    def __init__(self, build=build_gradio_app):
+        self.build = build
+        self.app = None
+        self._lifespan = None
+        self._lock = asyncio.Lock()
+
+    async def _load(self):
+        async with self._lock:
+            if self.app is None:
+                app = await asyncio.to_thread(self.build)
+                lifespan = app.router.lifespan_context(app)
+                await lifespan.__aenter__()
+                self._lifespan = lifespan
+                self.app = app
+        return self.app
+
+    async def __call__(self, scope, receive, send):
+        app = self.app or await self._load()
+        await app(scope, receive, send)
+
+    async def aclose(self):
+        if self._lifespan is not None:
+            await self._lifespan.__aexit__(None, None, None)
+            self._lifespan = None
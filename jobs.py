@@ -0,0 +1,139 @@
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from logs import get_logger
+from sqlitedb import JobDB, OrderReservation
+
+logger = get_logger("lhja.jobs")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    طابور مهام غير متزامن بعدد محدود من العمال، وحالة كل مهمة محفوظة في جدول Jobs.
+    عمليات القاعدة في العمال تُنفذ في thread حتى لا يتوقف الـ event loop.
+
+    الرصيد يُحجز عند الإضافة (OrderReservation) ويُعتمد عند النجاح أو يُعاد عند الفشل.
+    المهام غير المكتملة تبقى في الجدول وتُستأنف عند الإقلاع التالي عبر start(): مهام queued
+    فوراً، ومهام running فقط إذا لم تُحدَّث منذ stale_after ثانية (توقفت العملية التي كانت تنفذها).
+
+    runner: دالة async (kind, session_id, payload) ترجع نتيجة قابلة للتحويل إلى JSON.
+    notify: دالة async (url, body) لإرسال الـ webhook عند انتهاء المهمة.
+    """
+
+    def __init__(self, db: JobDB, quota, runner: Callable[[str, str, dict], Awaitable],
+                 notify: Callable[[str, dict], Awaitable] = None, workers: int = 4, max_depth: int = 1000,
+                 stale_after: float = 15 * 60):
+        self.db = db
+        self.quota = quota
+        self.runner = runner
+        self.notify = notify
+        self.workers = workers
+        self.max_depth = max_depth
+        self.stale_after = stale_after
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._reservations: Dict[str, OrderReservation] = {}
+        self.busy = 0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _spawn(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def start(self):
+        """
+        تشغيل العمال واستئناف المهام غير المكتملة من الجدول
+        """
+        self._spawn()
+        pending = await asyncio.to_thread(self.db.pending_jobs, time.time() - self.stale_after)
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        if pending:
+            logger.info("Resuming %d pending jobs", len(pending))
+
+    async def submit(self, session_id: str, kind: str, payload: dict, reservation: OrderReservation,
+                     webhook_url: str = None) -> str:
+        """
+        إضافة مهمة وإرجاع معرّفها فوراً. ترفع QueueFull إذا بلغ الطابور max_depth
+        (ويبقى الحجز على المستدعي ليعيده).
+        الصف يُكتب في thread، أما الطابور والعمال فيبقيان على الـ event loop لأنهما غير آمنين بين الـ threads
+        """
+        self._spawn()
+        if self._queue.qsize() >= self.max_depth:
+            raise QueueFull(f"Job queue is full ({self.max_depth} pending jobs)")
+        job_id = await asyncio.to_thread(self.db.add_job, session_id, kind, json.dumps(payload, ensure_ascii=False),
+                                         reservation.n, webhook_url, time.time())
+        if job_id is None:
+            raise RuntimeError("Could not persist job")
+        self._reservations[job_id] = reservation
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self.busy += 1
+            try:
+                await self._run(job_id)
+            except Exception:
+                logger.exception("Job %s crashed", job_id, extra={"job_id": job_id})
+            finally:
+                self.busy -= 1
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        now = time.time()
+        reservation = self._reservations.pop(job_id, None)
+        job = await asyncio.to_thread(self.db.claim_job, job_id, now, now - self.stale_after)
+        if job is None:
+            # أخذها عامل آخر (أو خادم آخر يشارك نفس القاعدة) وهو من يسوّي الرصيد
+            return
+        kind, session_id, orders, payload, webhook_url = job
+        if reservation is None:
+            # مهمة مُستأنفة بعد إعادة التشغيل: الرصيد محجوز في القاعدة منذ الإضافة
+            reservation = OrderReservation(self.quota, session_id, orders, 0)
+
+        try:
+            result = await self.runner(kind, session_id, json.loads(payload))
+        except asyncio.CancelledError:
+            # إيقاف الخادم: تعود المهمة إلى queued ويبقى الحجز حتى تُستأنف.
+            # كتابة مباشرة لأن المهمة أُلغيت ولا يُضمن إكمال await بعد الآن
+            self.db.requeue_job(job_id, time.time())
+            raise
+        except Exception as e:
+            await reservation.arefund()
+            status, result, error = "failed", None, str(e) or type(e).__name__
+            logger.warning("Job %s failed: %s", job_id, error, extra={"job_id": job_id})
+        else:
+            reservation.commit()
+            status, error = "succeeded", None
+        await asyncio.to_thread(self.db.finish_job, job_id, status,
+                                None if result is None else json.dumps(result, ensure_ascii=False), error, time.time())
+
+        if webhook_url and self.notify is not None:
+            body = {"job_id": job_id, "status": status, "result": result, "error": error}
+            try:
+                await self.notify(webhook_url, body)
+            except Exception as e:
+                logger.warning("Webhook for job %s failed: %s", job_id, e, extra={"job_id": job_id})
+
+    def stats(self):
+        return {"depth": self.depth, "workers": self.workers, "busy": self.busy, "max_depth": self.max_depth}
+
+    async def aclose(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
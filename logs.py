@@ -0,0 +1,64 @@
+"""
+سجلات منظمة (JSON سطراً لكل حدث) تحمل معرّف الطلب الحالي.
+
+معرّف الطلب في contextvar يضبطه MetricsMiddleware، فيصل تلقائياً إلى كل سجل يُكتب
+أثناء الطلب، بما في ذلك المهام الخلفية التي أُنشئت منه.
+"""
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+
+request_id = contextvars.ContextVar("request_id", default="-")
+
+# خصائص LogRecord القياسية؛ ما سواها مما يُمرر في extra يُكتب كحقول في السجل
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", request_id.get()),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
+
+def configure_logging(level: str = None, json_format: bool = None):
+    """
+    ضبط السجل الجذري مرة واحدة عند بدء الخادم.
+    LHJA_LOG_LEVEL (افتراضياً INFO) و LHJA_LOG_FORMAT=text لسجلات مقروءة أثناء التطوير
+    """
+    level = level or os.environ.get("LHJA_LOG_LEVEL", "INFO")
+    if json_format is None:
+        json_format = os.environ.get("LHJA_LOG_FORMAT", "json") != "text"
+    handler = logging.StreamHandler(sys.stderr)
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(JsonFormatter() if json_format else
+                         logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+    root = logging.getLogger()
+    for existing in [h for h in root.handlers if getattr(h, "_lhja", False)]:
+        root.removeHandler(existing)
+    handler._lhja = True
+    root.addHandler(handler)
+    root.setLevel(level.upper())
@@ -0,0 +1,227 @@
+"""
+مقاييس بصيغة Prometheus (text exposition) دون مكتبات خارجية.
+
+كل مقياس يحمي قيمه بقفل واحد، والتسجيل مجرد بحث في قاموس وزيادة أعداد، فالكلفة
+ميكروثوانٍ قليلة لكل عملية ويمكن تركه مفعلاً في الإنتاج.
+"""
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from logs import get_logger, request_id
+
+logger = get_logger("lhja.access")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                                 for labels, value in values]
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        # لكل مجموعة تسميات: [عدد كل bucket ...، +Inf، المجموع]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._values.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(labels, list(series)) for labels, series in self._values.items()]
+        lines = self._header()
+        for labels, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]):
+        """
+        collector: دالة تُستدعى عند كل قراءة وترجع (الاسم، الوصف، التسميات، القيمة) كقيم gauge،
+        لعرض إحصاءات محسوبة أصلاً (مثل نسب إصابة الكاش) دون تحديثها في المسار الساخن
+        """
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        gauges: Dict[str, Tuple[str, List[str]]] = {}
+        for collector in list(self._collectors):
+            try:
+                samples = list(collector())
+            except Exception:
+                logger.exception("Metrics collector failed")
+                continue
+            for name, documentation, labels, value in samples:
+                _, series = gauges.setdefault(name, (documentation, []))
+                series.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        for name, (documentation, series) in gauges.items():
+            lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} gauge"] + series)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = Histogram("lhja_http_request_duration_seconds", "HTTP request latency by route.",
+                                 ("method", "route", "status"))
+UPSTREAM_REQUEST_SECONDS = Histogram("lhja_upstream_request_duration_seconds",
+                                     "Azure chat/TTS call latency by service and status code.", ("service", "status"))
+DB_OPERATION_SECONDS = Histogram("lhja_db_operation_duration_seconds", "GeneralDatabase operation latency.",
+                                 ("operation",), buckets=DB_BUCKETS)
+DB_ERRORS = Counter("lhja_db_errors_total", "GeneralDatabase operations that raised.", ("operation",))
+BLOB_UPLOAD_BYTES = Counter("lhja_blob_upload_bytes_total", "Bytes uploaded to blob storage.")
+BLOB_UPLOAD_SECONDS = Histogram("lhja_blob_upload_duration_seconds", "Blob upload duration by outcome.", ("status",))
+QUOTA_REJECTIONS = Counter("lhja_quota_rejections_total", "Metered requests rejected before reaching upstream.",
+                           ("reason",))
+
+
+def timed(histogram: Histogram, *labels: str):
+    """
+    مزخرف لقياس زمن الدالة في histogram بالتسميات المعطاة
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: معرّف طلب لكل طلب (من X-Request-ID أو جديد) متاح للسجلات، وزمن الطلب حسب قالب المسار.
+
+    يُستخدم قالب المسار (مثل /company/sessions/{session_id}) لا المسار الفعلي حتى يبقى عدد السلاسل محدوداً.
+    """
+
+    def __init__(self, app, header: str = "x-request-id"):
+        self.app = app
+        self.header = header.encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        incoming = next((value for name, value in scope["headers"] if name == self.header), None)
+        rid = incoming.decode("latin-1")[:128] if incoming else uuid.uuid4().hex
+        token = request_id.set(rid)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(self.header, rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            template = getattr(route, "path_format", None) or getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(elapsed, scope["method"], template, str(status))
+            logger.info("request", extra={"method": scope["method"], "path": scope["path"], "status": status,
+                                          "duration_ms": round(elapsed * 1000, 3)})
+            request_id.reset(token)
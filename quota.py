@@ -0,0 +1,239 @@
+import atexit
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from sqlitedb import SessionDB, OrderReservation
+
+
+class _SessionQuota:
+    __slots__ = ("lock", "total", "used", "pending", "last_used", "evicted")
+
+    def __init__(self, total: int, used: int):
+        self.lock = threading.Lock()
+        self.total = total
+        self.used = used
+        self.pending = 0
+        self.last_used = time.monotonic()
+        # سجل أُخرج من الذاكرة؛ من يحمل مرجعاً قديماً إليه يعيد تحميل الجلسة
+        self.evicted = False
+
+
+class QuotaEngine:
+    """
+    عداد طلبات في الذاكرة أمام SessionDB مع كتابة مؤجلة (write-behind).
+
+    يحتفظ بالرصيد لكل جلسة ويخصم منه تحت قفل خاص بالجلسة، ثم يكتب الفروقات
+    المجمّعة إلى Sessions دفعة واحدة كل flush_interval ثانية أو عند بلوغ
+    flush_threshold طلباً، وعند الإغلاق. يفترض أن عملية واحدة فقط تخصم من الجلسة.
+
+    بعد كل كتابة يُعاد تحميل TotalOrders و UsedOrders للجلسات المكتوبة، فيظهر تعديل الرصيد
+    دون إعادة تشغيل. الجلسات التي لم تُستخدم منذ ttl ثانية (ولا فروقات معلّقة لها) تُخرج من
+    الذاكرة، وكذلك الأقدم استخداماً عند تجاوز max_entries.
+    """
+
+    def __init__(self, db: SessionDB, flush_interval: float = 1.0, flush_threshold: int = 500,
+                 ttl: float = 300, max_entries: int = 100000):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[str, _SessionQuota] = {}
+        self._entries_lock = threading.Lock()
+        self._evictions = 0
+        self._flush_lock = threading.Lock()
+        # عداد تقريبي يستخدم فقط لإطلاق الكتابة مبكراً
+        self._unflushed = 0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="quota-flush", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _entry(self, session_id: str) -> Optional[_SessionQuota]:
+        while True:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                return entry
+            evictions = self._evictions
+            rows = self.db.select(self.db.TABLE_NAME, ["TotalOrders", "UsedOrders"], "SessionId=?", (session_id,),
+                                  strict=True)
+            if not rows:
+                return None
+            with self._entries_lock:
+                # إذا أُخرج سجل أثناء القراءة فقد تكون القراءة أقدم من آخر كتابة له، فتُعاد
+                if self._evictions == evictions or session_id in self._entries:
+                    return self._entries.setdefault(session_id, _SessionQuota(*rows[0]))
+
+    def _mark_dirty(self, n: int):
+        self._unflushed += n
+        if self._unflushed >= self.flush_threshold:
+            self._wakeup.set()
+
+    def _locked_entry(self, session_id: str) -> Optional[_SessionQuota]:
+        """
+        سجل الجلسة مقفلاً؛ يُعاد التحميل إذا أُخرج السجل من الذاكرة بين قراءته وقفله
+        """
+        while True:
+            entry = self._entry(session_id)
+            if entry is None:
+                return None
+            entry.lock.acquire()
+            if not entry.evicted:
+                entry.last_used = time.monotonic()
+                return entry
+            entry.lock.release()
+
+    def consume_orders(self, session_id: str, n: int = 1):
+        entry = self._locked_entry(session_id)
+        if entry is None:
+            return None
+        try:
+            if entry.used + n > entry.total:
+                return None
+            entry.used += n
+            entry.pending += n
+            remaining = entry.total - entry.used
+        finally:
+            entry.lock.release()
+        self._mark_dirty(n)
+        return remaining
+
+    def refund_orders(self, session_id: str, n: int = 1) -> bool:
+        entry = self._locked_entry(session_id)
+        if entry is None:
+            return False
+        try:
+            if entry.used < n:
+                return False
+            entry.used -= n
+            entry.pending -= n
+        finally:
+            entry.lock.release()
+        self._mark_dirty(n)
+        return True
+
+    def reserve_orders(self, session_id: str, n: int = 1):
+        remaining = self.consume_orders(session_id, n)
+        if remaining is None:
+            return None
+        return OrderReservation(self, session_id, n, remaining)
+
+    def increment_used_orders(self, session_id: str) -> bool:
+        return self.consume_orders(session_id, 1) is not None
+
+    def update_used_orders(self, session_id: str, new_used_orders: int) -> bool:
+        """
+        تعيين UsedOrders مباشرة في القاعدة بعد كتابة الفروقات المعلّقة للجلسة
+        """
+        with self._flush_lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return self.db.update_used_orders(session_id, new_used_orders)
+            with entry.lock:
+                if entry.pending and not self._write({session_id: entry.pending}):
+                    return False
+                entry.pending = 0
+                success = self.db.update_used_orders(session_id, new_used_orders)
+                if success:
+                    entry.used = new_used_orders
+                return success
+
+    def delete_session(self, session_id: str) -> bool:
+        with self._flush_lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                with entry.lock:
+                    entry.evicted = True
+            return self.db.delete_session(session_id)
+
+    def _write(self, deltas: Dict[str, int]) -> bool:
+        return self.db.execute_many(
+            f"UPDATE {self.db.TABLE_NAME} SET UsedOrders = UsedOrders + ? WHERE SessionId = ?",
+            [(delta, session_id) for session_id, delta in deltas.items()]
+        )
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            self._unflushed = 0
+            deltas = {}
+            for session_id, entry in list(self._entries.items()):
+                with entry.lock:
+                    if entry.pending:
+                        deltas[session_id] = entry.pending
+                        entry.pending = 0
+            if not deltas:
+                self._evict()
+                return 0
+            if not self._write(deltas):
+                # إعادة الفروقات حتى لا تضيع عند فشل الكتابة
+                for session_id, delta in deltas.items():
+                    entry = self._entries.get(session_id)
+                    if entry is not None:
+                        with entry.lock:
+                            entry.pending += delta
+                return 0
+            self._reload(deltas)
+            self._evict()
+            return len(deltas)
+
+    def _reload(self, session_ids: Iterable[str], chunk_size: int = 500):
+        """
+        قراءة TotalOrders و UsedOrders بعد الكتابة؛ UsedOrders في القاعدة لا يشمل ما خُصم بعد الكتابة
+        (entry.pending) فيُضاف إليه
+        """
+        session_ids = list(session_ids)
+        for offset in range(0, len(session_ids), chunk_size):
+            chunk = session_ids[offset:offset + chunk_size]
+            rows = self.db.select(self.db.TABLE_NAME, ["SessionId", "TotalOrders", "UsedOrders"],
+                                  f"SessionId IN ({', '.join(['?'] * len(chunk))})", tuple(chunk))
+            for session_id, total, used in rows:
+                entry = self._entries.get(session_id)
+                if entry is not None:
+                    with entry.lock:
+                        entry.total = total
+                        entry.used = used + entry.pending
+
+    def _evict(self):
+        # يُستدعى تحت _flush_lock: الجلسات المنتهية أولاً، ثم الأقدم استخداماً عند تجاوز max_entries
+        expired_before = time.monotonic() - self.ttl
+        idle = [(entry.last_used, session_id) for session_id, entry in list(self._entries.items())
+                if not entry.pending]
+        overflow = len(self._entries) - self.max_entries
+        if overflow > 0:
+            idle.sort()
+        for last_used, session_id in idle:
+            if (last_used < expired_before or overflow > 0) and self._drop(session_id):
+                overflow -= 1
+
+    def _drop(self, session_id: str) -> bool:
+        with self._entries_lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return False
+            with entry.lock:
+                if entry.pending:
+                    return False
+                entry.evicted = True
+                del self._entries[session_id]
+            self._evictions += 1
+        return True
@@ -0,0 +1,161 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlitedb import RateLimitDB
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, n: float, now: float) -> float:
+        """
+        الانتظار حتى يتوفر min(n, capacity)؛ الطلب الأكبر من الدلو يُقبل حين يمتلئ ثم يتركه مديناً
+        """
+        self._refill(now)
+        need = min(n, self.capacity)
+        if self.tokens >= need:
+            return 0.0
+        return (need - self.tokens) / self.rate
+
+    def take(self, n: float):
+        # يُخصم n كاملاً ولو صار الرصيد سالباً، فتنتظر الطلبات التالية حتى يُسدَّد الفرق
+        self.tokens -= n
+
+    def give(self, n: float):
+        self.tokens = min(self.capacity, self.tokens + n)
+
+    def idle(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class _Lease:
+    __slots__ = ("limiter", "session_id", "released")
+
+    def __init__(self, limiter: "RateLimiter", session_id: str):
+        self.limiter = limiter
+        self.session_id = session_id
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.limiter._release(self.session_id)
+
+    def transfer(self) -> "_Lease":
+        """
+        نقل الـ lease لمن سيكمل الطلب (مثل البث) دون تحريره عند الخروج من الكتلة الحالية
+        """
+        self.released = True
+        return _Lease(self.limiter, self.session_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class RateLimiter:
+    """
+    حدّ معدل الطلبات (token bucket) لكل جلسة ولكل شركة، وحدّ لعدد الطلبات الجارية لكل جلسة.
+
+    الحالة في الذاكرة افتراضياً؛ مع db تُحفظ دلاء المعدل في SQLite وتُشارك بين العمليات
+    (عدد الطلبات الجارية يبقى محلياً لكل عملية). إنشاء الجدول مسؤولية المستدعي: db.create_table().
+    """
+
+    def __init__(self, session_rate: float = 10.0, session_burst: float = 20, company_rate: float = 100.0,
+                 company_burst: float = 200, max_in_flight: int = 8, db: Optional[RateLimitDB] = None,
+                 max_buckets: int = 100000):
+        self.session_rate = session_rate
+        self.session_burst = session_burst
+        self.company_rate = company_rate
+        self.company_burst = company_burst
+        self.max_in_flight = max_in_flight
+        self.db = db
+        self.max_buckets = max_buckets
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _bucket(self, key: str, rate: float, capacity: float, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._prune(now)
+            bucket = self._buckets[key] = TokenBucket(rate, capacity, now)
+        return bucket
+
+    def _prune(self, now: float):
+        for key in [key for key, bucket in self._buckets.items() if bucket.idle(now)]:
+            del self._buckets[key]
+
+    def _reject(self, retry_after: float, reason: str):
+        self.rejected += 1
+        raise RateLimited(retry_after, reason)
+
+    def acquire(self, session_id: str, company_id: str, n: int = 1) -> _Lease:
+        """
+        قبول الطلب أو رفع RateLimited مع مدة الانتظار المقترحة. يجب تحرير الـ lease عند انتهاء الطلب
+        """
+        with self._lock:
+            in_flight = self._in_flight.get(session_id, 0)
+            if in_flight >= self.max_in_flight:
+                self._reject(1.0, "Too many concurrent requests for this session")
+            if self.db is None:
+                now = time.monotonic()
+                session_bucket = self._bucket(f"s:{session_id}", self.session_rate, self.session_burst, now)
+                company_bucket = self._bucket(f"c:{company_id}", self.company_rate, self.company_burst, now)
+                # الدفعة تُحسب بعدد عناصرها كاملاً: الأكبر من الدلو تُقبل حين يمتلئ وتتركه مديناً
+                wait = max(session_bucket.wait_time(n, now), company_bucket.wait_time(n, now))
+                if wait > 0:
+                    self._reject(wait, "Rate limit exceeded")
+                session_bucket.take(n)
+                company_bucket.take(n)
+            self._in_flight[session_id] = in_flight + 1
+        if self.db is not None:
+            self._acquire_shared(session_id, company_id, n)
+        return _Lease(self, session_id)
+
+    def _acquire_shared(self, session_id: str, company_id: str, n: int):
+        now = time.time()
+        wait = self.db.take(f"s:{session_id}", self.session_rate, self.session_burst, n, now)
+        if wait == 0:
+            wait = self.db.take(f"c:{company_id}", self.company_rate, self.company_burst, n, now)
+            if wait > 0:
+                self.db.give(f"s:{session_id}", self.session_burst, n)
+        if wait > 0:
+            self._release(session_id)
+            with self._lock:
+                self._reject(wait, "Rate limit exceeded")
+
+    def _release(self, session_id: str):
+        with self._lock:
+            in_flight = self._in_flight.get(session_id, 0) - 1
+            if in_flight > 0:
+                self._in_flight[session_id] = in_flight
+            else:
+                self._in_flight.pop(session_id, None)
+
+    def stats(self):
+        return {"rejected": self.rejected, "buckets": len(self._buckets),
+                "in_flight": sum(self._in_flight.values())}
@@ -0,0 +1,47 @@
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Dict
+
+
+def scoped_key(key: str, credential: str) -> str:
+    """
+    مفتاح الدمج لطلب يُنفّذ بمفتاح خدمة معيّن: الطلبات بمفاتيح مختلفة لا تتشارك الاستدعاء،
+    حتى لا يُفشل مفتاحٌ منتهٍ لدى أول طلب بقية الطلبات ذات المفاتيح الصالحة
+    """
+    digest = hashlib.sha256(credential.encode("utf-8")).hexdigest()[:16]
+    return f"{key}:{digest}"
+
+
+class SingleFlight:
+    """
+    دمج الطلبات المتطابقة الجارية في نفس الوقت: أول طلب ينفّذ الاستدعاء،
+    وبقية الطلبات بنفس المفتاح تنتظر نتيجته بدلاً من استدعاء الخدمة مرة أخرى.
+
+    يعمل الاستدعاء في مهمة مستقلة، فانقطاع اتصال أحد المنتظرين لا يلغيه على الباقين.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.leaders += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # قراءة الاستثناء حتى لا يُسجَّل كخطأ غير مُستلم إذا لم ينتظره أحد
+            task.exception()
+
+    def stats(self):
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.shared}
@@ -0,0 +1,74 @@
+"""
+خادم بديل محلي لخدمات Azure OpenAI (المحادثة و TTS) لقياس الأداء دون اتصال.
+
+التشغيل:
+    STUB_LATENCY_MS=800 uvicorn stub_upstream:app --port 9000
+
+ثم توجيه الـ API إليه:
+    LHJA_CHAT_ENDPOINT=http://127.0.0.1:9000/openai/deployments/gpt-4o/chat/completions
+    LHJA_TTS_ENDPOINT=http://127.0.0.1:9000/openai/deployments/LAHJA-V1/audio/speech
+"""
+import asyncio
+import io
+import json
+import os
+import wave
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+LATENCY_MS = float(os.environ.get("STUB_LATENCY_MS", "500"))
+TOKEN_MS = float(os.environ.get("STUB_TOKEN_MS", "20"))
+AUDIO_SECONDS = float(os.environ.get("STUB_AUDIO_SECONDS", "2"))
+# زمن إضافي لكل حرف في نص TTS، لمحاكاة نمو زمن التركيب مع طول النص
+TTS_CHAR_MS = float(os.environ.get("STUB_TTS_CHAR_MS", "0"))
+SAMPLE_RATE = 24000
+
+app = FastAPI(title="Stub upstream")
+
+
+def make_wav(seconds: float, sample_rate: int = SAMPLE_RATE) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"\x00\x00" * int(seconds * sample_rate))
+    return buffer.getvalue()
+
+
+def completion_text(messages) -> str:
+    return "هلا والله، " + (messages[-1]["content"] if messages else "")
+
+
+async def stream_completion(body):
+    # زمن أول جزء يساوي تقريباً زمن المعالجة الأولي، ثم جزء كل TOKEN_MS
+    await asyncio.sleep(min(LATENCY_MS, 200) / 1000)
+    for word in completion_text(body.get("messages", [])).split(" "):
+        chunk = {"object": "chat.completion.chunk",
+                 "choices": [{"index": 0, "delta": {"content": word + " "}}]}
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        await asyncio.sleep(TOKEN_MS / 1000)
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request):
+    body = await request.json()
+    if body.get("stream"):
+        return StreamingResponse(stream_completion(body), media_type="text/event-stream")
+    await asyncio.sleep(LATENCY_MS / 1000)
+    return {
+        "id": "stub",
+        "object": "chat.completion",
+        "model": body.get("model", deployment),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": completion_text(body.get("messages", []))}}],
+    }
+
+
+@app.post("/openai/deployments/{deployment}/audio/speech")
+async def audio_speech(deployment: str, request: Request):
+    body = await request.json()
+    await asyncio.sleep((LATENCY_MS + TTS_CHAR_MS * len(body.get("input", ""))) / 1000)
+    return Response(content=make_wav(AUDIO_SECONDS), media_type="audio/wav")
@@ -0,0 +1,114 @@
+import os
+import sys
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
+
+import pytest
+
+# الوحدات في جذر المستودع وليست حزمة قابلة للتثبيت
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def stub_upstream(monkeypatch):
+    """
+    UpstreamClient يوجّه كل الطلبات إلى stub_upstream داخل نفس العملية (ASGITransport) دون شبكة أو تأخير
+    """
+    import httpx
+
+    import stub_upstream
+    from upstream import UpstreamClient
+
+    monkeypatch.setattr(stub_upstream, "LATENCY_MS", 0)
+    monkeypatch.setattr(stub_upstream, "TOKEN_MS", 0)
+    monkeypatch.setattr(stub_upstream, "AUDIO_SECONDS", 0.05)
+    upstream = UpstreamClient(retries=0, http2=False)
+    upstream._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub_upstream.app),
+                                         base_url="http://stub")
+    return upstream
+
+
+@pytest.fixture
+def api(tmp_path, stub_upstream):
+    """
+    UserHandler على قاعدة SQLite مؤقتة ومخزن Blob في الذاكرة وخدمات Azure بديلة (stub_upstream)،
+    مع TestClient يشغّل setup/start/aclose. client.session(total_orders) ينشئ جلسة ويرجع التوكن
+    """
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from blob_store import InMemoryBlobStore
+    from encrypt import UserHandler
+
+    handler = UserHandler(db_file=str(tmp_path / "api.db"), blob_store=InMemoryBlobStore(), upstream=stub_upstream)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        handler.setup()
+        await handler.start()
+        yield
+        await handler.aclose()
+
+    def session(total_orders: int = 100, company_id: str = "company-1"):
+        session_id = handler.db1.add_session(company_id, uuid.uuid4().hex, "Active", total_orders, 0)
+        return session_id, handler.cipher.encrypt(session_id)
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(handler.get_router(), prefix="/company")
+    with TestClient(app) as client:
+        client.handler = handler
+        client.session = session
+        yield client
+
+
+@pytest.fixture(scope="session")
+def postgres_url():
+    """
+    خادم PostgreSQL للاختبارات: LHJA_TEST_DATABASE_URL إن وُجد (مثلاً حاوية في CI)،
+    وإلا خادم محلي مؤقت عبر pgserver؛ تُتخطى اختبارات PostgreSQL إذا لم يتوفر أي منهما
+    """
+    url = os.environ.get("LHJA_TEST_DATABASE_URL")
+    if url:
+        yield url
+        return
+    pgserver = pytest.importorskip("pgserver")
+    with tempfile.TemporaryDirectory() as directory:
+        server = pgserver.get_server(directory, cleanup_mode="stop")
+        yield server.get_uri()
+        server.cleanup()
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def database_url(request, tmp_path):
+    """
+    نفس الاختبار على SQLite وعلى PostgreSQL. كل اختبار على PostgreSQL يعمل في مخطط (schema) جديد
+    خاص به يُحذف بعده، فلا تُلمس جداول أخرى على الخادم
+    """
+    if request.param == "sqlite":
+        yield f"sqlite:///{tmp_path / 'backend.db'}"
+        return
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.engine import make_url
+
+    import sqlitedb
+
+    base = request.getfixturevalue("postgres_url")
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin_url = make_url(base)
+    if admin_url.drivername == "postgresql":
+        admin_url = admin_url.set(drivername="postgresql+psycopg2")
+    admin = create_engine(admin_url)
+    with admin.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+    url = make_url(base).update_query_dict({"options": f"-csearch_path={schema}"}).render_as_string(
+        hide_password=False)
+    try:
+        yield url
+    finally:
+        engine = sqlitedb._ENGINES.pop(url, None)
+        if engine is not None:
+            engine.dispose()
+        with admin.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        admin.dispose()
@@ -0,0 +1,136 @@
+import json
+
+import pytest
+
+from aes_cipher import FAILED_FRAME, AESCipher, KeyRing
+
+PLAINTEXTS = ["session-1", "جلسة ٢", "", "x" * 5000]
+
+
+@pytest.fixture(params=["single_key", "keyring"])
+def cipher(request, tmp_path):
+    if request.param == "single_key":
+        return AESCipher()
+    return AESCipher(keyring=KeyRing.from_file(str(tmp_path / "keys.json"), create=True))
+
+
+def test_encrypt_many_round_trip_base64(cipher):
+    tokens = cipher.encrypt_many(PLAINTEXTS)
+    assert len(set(tokens)) == len(tokens)
+    assert cipher.decrypt_many(tokens) == PLAINTEXTS
+    # الدفعة متوافقة مع التشفير المفرد في الاتجاهين
+    assert [cipher.decrypt(token) for token in tokens] == PLAINTEXTS
+    assert cipher.decrypt_many([cipher.encrypt(text) for text in PLAINTEXTS]) == PLAINTEXTS
+
+
+def test_encrypt_many_round_trip_raw(cipher):
+    data = [text.encode("utf-8") for text in PLAINTEXTS]
+    blobs = cipher.encrypt_many(data, raw=True)
+    assert all(isinstance(blob, bytes) for blob in blobs)
+    assert cipher.decrypt_many(blobs, raw=True) == data
+
+
+def test_raw_frames_round_trip(cipher):
+    data = [text.encode("utf-8") for text in PLAINTEXTS]
+    body = AESCipher.pack_frames(cipher.encrypt_many(AESCipher.unpack_frames(AESCipher.pack_frames(data)),
+                                                     raw=True))
+    frames = AESCipher.unpack_frames(body)
+    assert [bytes(item) for item in cipher.decrypt_many(frames, raw=True)] == data
+
+
+def test_decrypt_many_reports_failed_items(cipher):
+    tokens = cipher.encrypt_many(["a", "b"])
+    assert cipher.decrypt_many([tokens[0], "not-a-token", tokens[1]]) == ["a", None, "b"]
+    blobs = cipher.encrypt_many([b"a"], raw=True)
+    assert cipher.decrypt_many([blobs[0], b"\x00" * 40], raw=True) == [b"a", None]
+
+
+def test_pack_frames_marks_failures():
+    body = AESCipher.pack_frames([b"ab", None, b""])
+    assert body == b"\x00\x00\x00\x02ab" + FAILED_FRAME.to_bytes(4, "big") + b"\x00\x00\x00\x00"
+    assert [None if frame is None else bytes(frame) for frame in AESCipher.unpack_frames(body)] == [b"ab", None, b""]
+    with pytest.raises(ValueError):
+        AESCipher.unpack_frames(b"\x00\x00\x00\x05ab")
+
+
+def test_keyring_tokens_survive_rotation(tmp_path):
+    path = str(tmp_path / "keys.json")
+    cipher = AESCipher(keyring=KeyRing.from_file(path, create=True))
+    old_id = cipher.key_id
+    token = cipher.encrypt("session-1")
+    blob = cipher.encrypt_many([b"session-1"], raw=True)[0]
+    assert token.startswith(f"{old_id}.")
+
+    new_id = cipher.keyring.rotate()
+    assert cipher.key_id == new_id != old_id
+    assert cipher.decrypt(token) == "session-1"
+    assert cipher.decrypt_many([blob], raw=True) == [b"session-1"]
+
+    # عملية أخرى تقرأ نفس الملف تفك توكنات المفتاح الجديد
+    other = AESCipher(keyring=KeyRing.from_file(path))
+    assert other.decrypt(cipher.encrypt("session-2")) == "session-2"
+
+    cipher.keyring.rotate(retire=[old_id])
+    assert cipher.decrypt_many([token]) == [None]
+
+
+def test_batch_with_mixed_key_ids(tmp_path):
+    cipher = AESCipher(keyring=KeyRing.from_file(str(tmp_path / "keys.json"), create=True))
+    old_tokens = cipher.encrypt_many(["a", "b"])
+    old_blobs = cipher.encrypt_many([b"a", b"b"], raw=True)
+    cipher.keyring.rotate()
+    tokens = old_tokens + cipher.encrypt_many(["c"]) + ["garbage"]
+    assert cipher.decrypt_many(tokens) == ["a", "b", "c", None]
+    blobs = cipher.encrypt_many([b"c"], raw=True) + old_blobs
+    assert cipher.decrypt_many(AESCipher.unpack_frames(AESCipher.pack_frames(blobs)), raw=True) == [b"c", b"a", b"b"]
+
+
+def test_legacy_tokens_without_key_id(tmp_path):
+    key = AESCipher.generate_key()
+    legacy = AESCipher(key).encrypt("session-1")
+    keyring = KeyRing({"k1": key}, "k1")
+    assert AESCipher(keyring=keyring).decrypt(legacy) == "session-1"
+    assert AESCipher.key_from_base64(AESCipher.key_to_base64(key)) == key
+
+
+def test_raw_api_rejects_failed_frame_in_request(api):
+    body = AESCipher.pack_frames([b"a", None])
+    response = api.post("/company/encrypt/batch/raw", content=body)
+    assert response.status_code == 400
+    response = api.post("/company/encrypt/batch/raw", content=AESCipher.pack_frames([b"a", b"b"]))
+    assert response.status_code == 200
+    encrypted = AESCipher.unpack_frames(response.content)
+    response = api.post("/company/decrypt/batch/raw", content=AESCipher.pack_frames(encrypted))
+    assert [bytes(frame) for frame in AESCipher.unpack_frames(response.content)] == [b"a", b"b"]
+
+
+def test_only_file_backed_keyrings_rotate(monkeypatch):
+    monkeypatch.delenv("LHJA_AES_KEYRING", raising=False)
+    monkeypatch.setenv("LHJA_AES_KEYS", f"k1:{AESCipher.key_to_base64(AESCipher.generate_key())}")
+    keyring = KeyRing.from_env()
+    with pytest.raises(ValueError):
+        keyring.rotate()
+    assert keyring.key_ids() == ["k1"]
+
+
+def test_rotate_cli(tmp_path, capsys):
+    from aes_cipher import main
+
+    path = str(tmp_path / "keys.json")
+    assert main(["rotate", "--keyring", path]) == 0
+    old = KeyRing.from_file(path).key_ids()
+    assert main(["rotate", "--keyring", path] + [arg for kid in old for arg in ("--retire", kid)]) == 0
+    keyring = KeyRing.from_file(path)
+    assert keyring.key_ids() == [keyring.current] and keyring.current not in old
+    assert main(["list", "--keyring", path]) == 0
+    assert json.loads(capsys.readouterr().out.splitlines()[-1]) == \
+        {"current": keyring.current, "keys": [keyring.current]}
+
+
+def test_api_never_returns_key_material(api):
+    response = api.post("/company/encrypt", json={"text": "session-1"})
+    assert response.status_code == 200
+    assert set(response.json()) == {"encrypted", "key_id"}
+    assert api.post("/company/decrypt", json={"text": response.json()["encrypted"]}).json() == \
+        {"decrypted": "session-1"}
+    assert api.post("/company/keys/rotate").status_code in (404, 405)
@@ -0,0 +1,125 @@
+import io
+import struct
+import wave
+
+import pytest
+
+from audio import concat_audio, concat_wav, split_sentences
+
+LATIN = ("The first sentence is short. The second one asks a question? Then an exclamation! "
+         "A long sentence follows, with clauses; separated by commas, semicolons: and colons, "
+         "so it is cut at clause boundaries, not at sentence ends.")
+ARABIC = ("هلا والله، كيف حالك؟ هذي جملة ثانية. وهذي جملة طويلة فيها فواصل كثيرة، وكل فاصلة تفصل جزءاً؛ "
+          "والمطلوب أن ينقسم النص عند الفواصل قبل المسافات… ثم جملة أخيرة!")
+
+
+@pytest.mark.parametrize("text", [LATIN, ARABIC])
+@pytest.mark.parametrize("max_chars", [30, 60, 120])
+def test_split_sentences_respects_limit_and_keeps_words(text, max_chars):
+    chunks = split_sentences(text, max_chars)
+    assert all(0 < len(chunk) <= max_chars for chunk in chunks)
+    assert " ".join(chunks).split() == text.split()
+
+
+@pytest.mark.parametrize("text", [LATIN, ARABIC])
+def test_split_prefers_sentence_then_clause_boundaries(text):
+    # كل جزء ينتهي عند نهاية جملة أو فاصلة ما دامت الجمل والعبارات أقصر من الحد
+    chunks = split_sentences(text, 60)
+    assert len(chunks) > 2
+    assert all(chunk[-1] in ".?!,;:؟…،؛" for chunk in chunks)
+    assert split_sentences(text, 60)[0].endswith(("?", "."))
+
+
+def test_split_long_words_only_at_spaces():
+    text = " ".join(["كلمة"] * 50)
+    chunks = split_sentences(text, 23)
+    assert all(len(chunk) <= 23 for chunk in chunks)
+    assert " ".join(chunks) == text
+
+
+@pytest.mark.parametrize("text, expected", [("", []), ("   ", []), ("قصير", ["قصير"])])
+def test_split_short_text(text, expected):
+    assert split_sentences(text, 10) == expected
+
+
+def _wav(frames: bytes, channels: int = 1, width: int = 2, rate: int = 24000, data_size: int = None) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(channels)
+        out.setsampwidth(width)
+        out.setframerate(rate)
+        out.writeframes(frames)
+    data = buffer.getvalue()
+    if data_size is not None:
+        # ترويسة بث لا تعرف الحجم مسبقاً
+        pos = data.index(b"data")
+        data = data[:pos + 4] + struct.pack("<I", data_size) + data[pos + 8:]
+    return data
+
+
+def _read(data: bytes):
+    with wave.open(io.BytesIO(data), "rb") as wav:
+        return wav.getnchannels(), wav.getsampwidth(), wav.readframes(wav.getnframes())
+
+
+@pytest.mark.parametrize("data_size", [None, 0, 0xFFFFFFFF])
+def test_concat_wav_rewrites_header(data_size):
+    first, second = b"\x01\x00" * 100, b"\x02\x00" * 50
+    merged = concat_wav([_wav(first, data_size=data_size), _wav(second, data_size=data_size)])
+    assert struct.unpack_from("<I", merged, 4)[0] == len(merged) - 8
+    assert _read(merged) == (1, 2, first + second)
+
+
+def test_concat_wav_trims_partial_frames_and_pads():
+    # ستيريو 16 بت: كل إطار 4 بايت، والبث قد ينقطع في منتصف إطار
+    frame = b"\x01\x00\x02\x00"
+    partial = _wav(frame * 10, channels=2, data_size=0) + b"\x03\x00\x04"
+    merged = concat_wav([partial, _wav(frame * 5, channels=2)])
+    assert _read(merged) == (2, 2, frame * 15)
+    # بيانات بطول فردي تُتبع ببايت حشو كما يتطلب RIFF
+    odd = concat_wav([_wav(b"\x01" * 3, width=1), _wav(b"\x02" * 2, width=1)])
+    assert len(odd) % 2 == 0 and _read(odd) == (1, 1, b"\x01" * 3 + b"\x02" * 2)
+
+
+@pytest.mark.parametrize("other", [
+    _wav(b"\x00\x00" * 10, rate=16000),
+    _wav(b"\x00\x00" * 10, channels=2),
+    _wav(b"\x00" * 10, width=1),
+])
+def test_concat_wav_rejects_mismatched_formats(other):
+    with pytest.raises(ValueError):
+        concat_wav([_wav(b"\x00\x00" * 10), other])
+
+
+@pytest.mark.parametrize("data", [b"not a wav file", b"RIFF\x00\x00\x00\x00WAVE", b"RIFF\x04\x00\x00\x00WAVEdata"])
+def test_concat_wav_rejects_invalid_files(data):
+    with pytest.raises(ValueError):
+        concat_wav([_wav(b"\x00\x00"), data])
+
+
+def _id3v2(body: bytes = b"TIT2 payload") -> bytes:
+    size = len(body)
+    synchsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b"ID3\x04\x00\x00" + synchsafe + body
+
+
+ID3V1 = b"TAG" + b"t" * 125
+
+
+def test_concat_mp3_keeps_id3_only_at_the_ends():
+    frames = [b"\xff\xfb" + bytes([i]) * 200 for i in range(3)]
+    segments = [_id3v2() + frame + ID3V1 for frame in frames]
+    merged = concat_audio(segments, "mp3")
+    assert merged == _id3v2() + b"".join(frames) + ID3V1
+
+
+def test_concat_aac_without_tags():
+    frames = [b"\xff\xf1" + bytes([i]) * 64 for i in range(2)]
+    assert concat_audio(frames, "aac") == b"".join(frames)
+
+
+def test_concat_audio_other_formats():
+    assert concat_audio([b"only"], "flac") == b"only"
+    assert concat_audio([b"ab", b"cd"], "pcm") == b"abcd"
+    with pytest.raises(ValueError):
+        concat_audio([b"a", b"b"], "opus")
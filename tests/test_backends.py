@@ -0,0 +1,173 @@
+import pytest
+
+from sqlitedb import CacheDB, CompanyDB, JobDB, RateLimitDB, SessionDB, UsageDB, _to_pyformat
+
+
+@pytest.fixture
+def sessions(database_url):
+    db = SessionDB(database_url)
+    db.create_table()
+    yield db
+    db.close()
+
+
+def _tables(db):
+    if db.dialect == "postgresql":
+        rows = db.execute("SELECT tablename FROM pg_tables WHERE schemaname = current_schema()")
+    else:
+        rows = db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return {row[0].lower() for row in rows}
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT * FROM t WHERE a = ? AND b = ?", "SELECT * FROM t WHERE a = %s AND b = %s"),
+    # ? داخل نص حرفي ليست معاملاً، و% تُهرَّب في كل مكان
+    ("SELECT ? || '?%' FROM t WHERE c LIKE 'a%'", "SELECT %s || '?%%' FROM t WHERE c LIKE 'a%%'"),
+    ("SELECT 'it''s ?', ?", "SELECT 'it''s ?', %s"),
+])
+def test_to_pyformat(query, expected):
+    assert _to_pyformat(query) == expected
+
+
+def test_placeholders_and_literals(sessions):
+    rows = sessions.execute("SELECT ? || '?%', CASE WHEN 'a%b' LIKE 'a%' THEN 1 ELSE 0 END", ("x",))
+    assert [tuple(row) for row in rows] == [("x?%", 1)]
+
+
+def test_consume_and_refund(sessions):
+    session_id = sessions.add_session("c1", "t1", "Active", 3, 0)
+    assert sessions.consume_orders(session_id, 2) == 1
+    assert sessions.consume_orders(session_id, 2) is None
+    assert sessions.refund_orders(session_id, 2)
+    assert not sessions.refund_orders(session_id, 5)
+    assert sessions.select(sessions.TABLE_NAME, ["UsedOrders"], "SessionId=?", (session_id,)) == [(0,)]
+
+
+def test_insert_many_keeps_valid_rows(sessions):
+    # التوكن المكرر يُفشل executemany كاملاً؛ في PostgreSQL يلزم savepoint لكل صف حتى تُحفظ البقية
+    results = sessions.add_sessions([
+        {"company_id": "c1", "token": "dup"},
+        {"company_id": "c1", "token": "dup"},
+        {"company_id": "c1", "token": "unique"},
+    ])
+    assert [session_id is not None for session_id, _ in results] == [True, False, True]
+    assert results[1][1]
+    rows = sessions.select(sessions.TABLE_NAME, ["Token"])
+    assert sorted(row[0] for row in rows) == ["dup", "unique"]
+
+
+def test_explain(sessions):
+    sessions.execute_many(
+        f"INSERT INTO {sessions.TABLE_NAME} (SessionId, CompanyId, Token, LoginTime, Status) VALUES (?, ?, ?, ?, ?)",
+        [(f"s{i:05d}", f"c{i % 50}", f"t{i}", f"2026-01-01T00:00:{i % 60:02d}", "Active") for i in range(5000)]
+    )
+    sessions.execute("ANALYZE")
+    lookup = sessions.explain(f"SELECT * FROM {sessions.TABLE_NAME} WHERE SessionId = ?", ("s00042",))
+    assert not lookup["full_scan"] and lookup["indexes"]
+    scan = sessions.explain(f"SELECT * FROM {sessions.TABLE_NAME} WHERE LoginTime = ?", ("x",))
+    assert scan["full_scan"] and scan["full_scans"]
+
+
+def test_cache_upsert(database_url):
+    db = CacheDB(database_url)
+    db.create_table()
+    db.set_value("k", "v1", 200.0)
+    db.set_value("k", "v2", 300.0)
+    assert db.get_value("k", 100.0) == "v2"
+    assert db.get_value("k", 300.0) is None
+    db.close()
+
+
+def test_rate_bucket_least(database_url):
+    db = RateLimitDB(database_url)
+    db.create_table()
+    assert db.take("b", rate=1.0, capacity=2.0, n=1.0, now=100.0) == 0.0
+    assert db.take("b", rate=1.0, capacity=2.0, n=1.0, now=100.0) == 0.0
+    assert db.take("b", rate=1.0, capacity=2.0, n=1.0, now=100.0) == pytest.approx(1.0)
+    # الاسترداد لا يتجاوز سعة الدلو
+    db.give("b", 2.0, 5.0)
+    assert db.select(db.TABLE_NAME, ["Tokens"], "BucketKey=?", ("b",)) == [(2.0,)]
+    assert db.take("b", rate=1.0, capacity=2.0, n=1.0, now=1000.0) == 0.0
+    assert db.select(db.TABLE_NAME, ["Tokens"], "BucketKey=?", ("b",)) == [(1.0,)]
+    db.close()
+
+
+def test_update_many_per_row_results(database_url):
+    db = CompanyDB(database_url)
+    db.create_table()
+    (first, _), (second, _) = db.add_companies([{"name": "a", "license_number": "L1"},
+                                                {"name": "b", "license_number": "L2"}])
+
+    def company(company_id, name, license_number):
+        return {"company_id": company_id, "name": name, "license_number": license_number, "employees": 3,
+                "services": "tts"}
+
+    # المسار السريع: كل المفاتيح موجودة
+    assert db.update_companies([company(first, "a2", "L1"), company(second, "b2", "L2")]) == [(first, None),
+                                                                                              (second, None)]
+    # مفتاح غير موجود وقيد UNIQUE مخالف لا يمنعان حفظ الصفوف السليمة
+    results = db.update_companies([company(first, "a3", "L1"), company("missing", "x", "L9"),
+                                   company(second, "b3", "L1")])
+    assert [error is None for _, error in results] == [True, False, False]
+    assert "not found" in results[1][1]
+    assert "unique" in results[2][1].lower()
+    rows = db.select(db.TABLE_NAME, ["Id", "Name", "LicenseNumber", "EmployeesCount"])
+    assert sorted(tuple(row) for row in rows) == sorted([(first, "a3", "L1", 3), (second, "b2", "L2", 3)])
+    assert db.update_many(db.TABLE_NAME, [], "Id") == []
+    db.close()
+
+
+def test_pending_jobs_order_and_limit(database_url):
+    db = JobDB(database_url)
+    db.create_table()
+    jobs = [db.add_job("s1", "speech", "{}", 1, None, now=float(now)) for now in (30, 10, 20, 40)]
+    db.claim_job(jobs[0], now=30.0, stale_before=0.0)
+    db.claim_job(jobs[3], now=50.0, stale_before=0.0)
+    db.finish_job(jobs[2], "succeeded", "url", None, now=25.0)
+    # المهمة المنتهية لا تُستأنف، والمهمة running تُستأنف فقط إذا توقف تحديثها
+    assert db.pending_jobs(stale_before=45.0) == [jobs[1], jobs[0]]
+    assert db.pending_jobs(stale_before=60.0, limit=2) == [jobs[1], jobs[0]]
+    assert db.pending_jobs(stale_before=60.0) == [jobs[1], jobs[0], jobs[3]]
+    db.close()
+
+
+def test_usage_rollup_greatest(database_url):
+    db = UsageDB(database_url)
+    db.create_table()
+    for latency in (10.0, 4.0):
+        ledger = [(1.0, "s1", "c1", "/T2T", 200, 1, latency, 3, 5, 7)]
+        rollup = [("c1", 0, "s1", "/T2T", 1, 0, 1, latency, latency, 3, 5, 7)]
+        assert db.write_usage(ledger, {"hour": rollup, "day": rollup})
+    report = db.usage_report("c1", "hour", 0, 3600)
+    assert [tuple(row) for row in report] == [(0, "/T2T", 2, 0, 2, 14.0, 10.0, 6, 10, 14)]
+    db.close()
+
+
+def test_usage_purge_ledger_returns_count(database_url, caplog):
+    db = UsageDB(database_url)
+    db.create_table()
+    rows = [(at, "s1", "c1", "/T2T", 200, 1, 1.0, 0, 0, 0) for at in (1.0, 2.0, 5.0)]
+    rollup = [("c1", 0, "s1", "/T2T", 3, 0, 3, 3.0, 1.0, 0, 0, 0)]
+    assert db.write_usage(rows, {"hour": rollup, "day": rollup})
+    with caplog.at_level("INFO"):
+        assert db.purge_ledger(3.0) == 2
+        # لا صفوف قديمة: ليست حالة فشل ولا تُسجَّل
+        assert db.purge_ledger(3.0) == 0
+    assert not caplog.records
+    assert [tuple(row) for row in db.select(db.TABLE_NAME, ["At"])] == [(5.0,)]
+    # التجميع لا يتأثر بحذف السجل الخام
+    assert db.usage_report("c1", "hour", 0, 3600)[0][2] == 3
+    db.close()
+
+
+def test_bench_leaves_existing_tables_alone(sessions, database_url):
+    from bench.micro import bench_db, bench_quota
+
+    session_id = sessions.add_session("c1", "keep", "Active", 5, 1)
+    before = _tables(sessions)
+    result = bench_quota(threads=2, per_thread=10, total_orders=10, database_url=database_url)
+    assert result["committed"] == result["used_orders"] <= 10
+    bench_db([100], sample=10, database_url=database_url)
+    assert _tables(sessions) == before
+    assert sessions.select(sessions.TABLE_NAME, ["Token", "UsedOrders"], "SessionId=?", (session_id,)) == \
+        [("keep", 1)]
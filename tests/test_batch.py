@@ -0,0 +1,178 @@
+import asyncio
+import json
+
+import pytest
+
+from upstream import UpstreamError
+
+
+def _companies(api, *licenses):
+    response = api.post("/company/companies/batch",
+                        json=[{"name": f"co-{license}", "license_number": license} for license in licenses])
+    assert response.status_code == 200
+    return [item["company_id"] for item in response.json()["results"]]
+
+
+def test_update_companies_batch(api):
+    first, second = _companies(api, "L1", "L2")
+    update = {"employees": 7, "services": "tts"}
+    response = api.put("/company/companies/batch", json=[
+        {"company_id": first, "name": "renamed", "license_number": "L1", **update},
+        {"company_id": "missing", "name": "x", "license_number": "L3", **update},
+        {"company_id": second, "name": "dup", "license_number": "L1", **update},
+    ])
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["updated"], body["failed"]) == (1, 2)
+    assert [item["company_id"] for item in body["results"]] == [first, "missing", second]
+    assert [item["error"] is None for item in body["results"]] == [True, False, False]
+    rows = api.handler.db.select("Company", ["Id", "Name", "EmployeesCount"])
+    assert sorted(tuple(row) for row in rows) == sorted([(first, "renamed", 7), (second, "co-L2", 0)])
+
+
+OPTIONS = {"text_deployment_name": "gpt-4o", "api_version": "v", "base_url": "https://x", "use_cache": False}
+
+
+@pytest.fixture
+def fake_chat(api):
+    # رسائل تبدأ بـ bad تفشل في الخدمة؛ ويُسجل أعلى عدد من الطلبات المتزامنة
+    state = {"active": 0, "peak": 0}
+
+    async def chat(message, api_key, dialect="", use_cache=True):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        try:
+            await asyncio.sleep(0.01)
+            if message.startswith("bad"):
+                raise UpstreamError(f"failed: {message}")
+            return f"ok: {message}"
+        finally:
+            state["active"] -= 1
+
+    api.handler.chat = chat
+    return state
+
+
+def _batch(api, token, messages, **extra):
+    return api.post("/company/T2T/batch", params={"Customize_the_dialect": "najdi", "token": token},
+                    json={"messages": messages, "options": OPTIONS, **extra})
+
+
+def _used(api, session_id):
+    api.handler.usage.flush()
+    used = api.handler.db1.select("Sessions", ["UsedOrders"], "SessionId=?", (session_id,))[0][0]
+    orders = api.handler.usage.db.select("UsageLedger", ["Endpoint", "Orders"], "SessionId=?", (session_id,))
+    return used, [tuple(row) for row in orders]
+
+
+def test_t2t_batch_refunds_failed_items(api, fake_chat):
+    session_id, token = api.session(total_orders=10)
+    messages = ["a", "bad-1", "b", "bad-2", "c"]
+    response = _batch(api, token, messages, max_parallel=2)
+    assert response.status_code == 200
+    body = response.json()
+    assert [item["index"] for item in body["Responses"]] == list(range(5))
+    assert [item["response"] for item in body["Responses"]] == ["ok: a", None, "ok: b", None, "ok: c"]
+    assert [item["error"] for item in body["Responses"]] == [None, "failed: bad-1", None, "failed: bad-2", None]
+    assert body["RemainingOrders"] == 7
+    assert fake_chat["peak"] == 2
+    assert _used(api, session_id) == (3, [("/T2T/batch", 3)])
+    assert api.handler.rate_limiter.stats()["in_flight"] == 0
+
+
+def test_t2t_batch_all_failed_refunds_everything(api, fake_chat):
+    session_id, token = api.session(total_orders=10)
+    response = _batch(api, token, ["bad-1", "bad-2"])
+    assert response.status_code == 200
+    assert all(item["error"] for item in response.json()["Responses"])
+    assert _used(api, session_id) == (0, [("/T2T/batch", 0)])
+
+
+def test_t2t_batch_reserves_the_whole_batch(api, fake_chat):
+    session_id, token = api.session(total_orders=3)
+    # الرصيد لا يكفي الدفعة كاملة، فلا يُنفذ منها شيء
+    response = _batch(api, token, ["a", "b", "c", "d"])
+    assert response.status_code == 403
+    assert fake_chat["peak"] == 0
+    assert _used(api, session_id)[0] == 0
+
+
+@pytest.mark.parametrize("count", [0, 101])
+def test_t2t_batch_size_limits(api, fake_chat, count):
+    _, token = api.session()
+    assert _batch(api, token, ["a"] * count).status_code == 400
+
+
+def _sessions(api, count, company_id="company-1"):
+    response = api.post("/company/sessions/batch", json=[
+        {"company_id": company_id, "token": f"{company_id}-{i}", "status": "Active" if i % 2 else "Inactive"}
+        for i in range(count)])
+    assert response.json()["created"] == count
+    return [item["session_id"] for item in response.json()["results"]]
+
+
+def _pages(api, path, **params):
+    seen, after, pages = [], None, 0
+    while True:
+        query = dict(params, **({"after": after} if after else {}))
+        body = api.get(path, params=query).json()
+        seen += [row[0] for row in body["Sessions"]]
+        pages += 1
+        after = body["next"]
+        if after is None:
+            return seen, pages
+
+
+def test_sessions_keyset_pagination(api):
+    ids = _sessions(api, 25)
+    seen, pages = _pages(api, "/company/sessions", limit=10, columns="SessionId,Status")
+    assert seen == sorted(ids) and pages == 3
+    # صف يُضاف أثناء المرور لا يُكرر صفاً ولا يُسقط صفاً، ويظهر فقط إن كان بعد المؤشر
+    first = api.get("/company/sessions", params={"limit": 10, "columns": "SessionId"}).json()
+    late = api.handler.db1.add_session("company-1", "late", "Active", 0, 0)
+    rest, _ = _pages(api, "/company/sessions", limit=10, after=first["next"], columns="SessionId")
+    combined = [row[0] for row in first["Sessions"]] + rest
+    assert len(combined) == len(set(combined)) and set(ids) <= set(combined)
+    assert (late in rest) == (late > first["next"])
+    assert api.get("/company/sessions", params={"columns": "SessionId,Nope"}).status_code == 400
+
+
+def test_company_sessions_pagination_filters(api):
+    ids = _sessions(api, 12)
+    _sessions(api, 5, company_id="company-2")
+    seen, pages = _pages(api, "/company/companies/company-1/sessions", limit=4, columns="SessionId")
+    # صفحة ممتلئة تعيد مؤشراً دائماً، فالصفحة الأخيرة هنا فارغة
+    assert seen == sorted(ids) and pages == 4
+    active, _ = _pages(api, "/company/companies/company-1/sessions", limit=4, active_only=True, columns="SessionId")
+    assert active == sorted(ids[1::2])
+
+
+def test_sessions_export_streams_in_chunks(api, monkeypatch):
+    db = api.handler.db1
+    ids = [session_id for session_id, _ in db.add_sessions([{"company_id": "company-1", "token": f"t{i}"}
+                                                            for i in range(2500)])]
+    pages = []
+    select_page = db.select_page
+
+    def recording(*args, **kwargs):
+        rows, after = select_page(*args, **kwargs)
+        pages.append(len(rows))
+        return rows, after
+
+    monkeypatch.setattr(db, "select_page", recording)
+    with api.stream("GET", "/company/sessions/export", params={"columns": "SessionId,Token"}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.iter_lines() if line]
+    assert [line["SessionId"] for line in lines] == sorted(ids)
+    assert set(lines[0]) == {"SessionId", "Token"}
+    # الجدول يُقرأ على دفعات ثابتة الحجم وليس باستعلام واحد
+    assert pages == [1000, 1000, 500]
+
+
+def test_companies_export(api):
+    ids = _companies(api, "L1", "L2", "L3")
+    response = api.get("/company/companies/export")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["Id"] for line in lines] == sorted(ids)
+    assert lines[0]["LicenseNumber"].startswith("L")
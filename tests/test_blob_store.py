@@ -0,0 +1,70 @@
+import asyncio
+import base64
+
+import pytest
+
+from blob_store import BlobStore, InMemoryBlobStore
+
+
+async def _chunks(parts, fail_after=None):
+    for i, part in enumerate(parts):
+        # إفساح المجال لبدء رفع الكتل السابقة كما يحدث مع بث حقيقي
+        await asyncio.sleep(0.001)
+        if fail_after is not None and i == fail_after:
+            raise RuntimeError("upstream closed")
+        yield part
+
+
+class _SlowFirstBlock(InMemoryBlobStore):
+    """
+    الكتلة الأولى أبطأ من البقية، فتنتهي الكتل بترتيب مختلف عن ترتيب إرسالها
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.started = []
+        self.cancelled = []
+
+    async def _stage_block(self, name, block_id, data):
+        self.started.append(block_id)
+        try:
+            await asyncio.sleep(0.05 if block_id == self._block_id(0) else 0)
+        except asyncio.CancelledError:
+            self.cancelled.append(block_id)
+            raise
+        await super()._stage_block(name, block_id, data)
+
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        BlobStore()
+
+
+def test_upload_splits_into_ordered_blocks():
+    store = _SlowFirstBlock(block_size=4, max_concurrency=2)
+    parts = [b"ab", b"cdefg", b"", b"hijklm", b"n"]
+    size = asyncio.run(store.upload_stream("a.wav", _chunks(parts), "audio/wav"))
+
+    data = b"".join(parts)
+    assert size == len(data)
+    assert store.blobs["a.wav"] == data
+    assert store.content_types["a.wav"] == "audio/wav"
+    # كتل بحجم block_size عدا الأخيرة، ومعرّفات مرتبة ثابتة الطول كما يتطلب Azure
+    assert [base64.b64decode(block_id) for block_id in store.started] == [b"00000000", b"00000001",
+                                                                         b"00000002", b"00000003"]
+    assert not store.staged
+
+
+def test_empty_stream_commits_empty_blob():
+    store = InMemoryBlobStore(block_size=4)
+    assert asyncio.run(store.upload_stream("empty.wav", _chunks([]))) == 0
+    assert store.blobs["empty.wav"] == b""
+
+
+def test_failed_stream_cancels_pending_blocks_and_does_not_commit():
+    store = _SlowFirstBlock(block_size=2, max_concurrency=4)
+    with pytest.raises(RuntimeError):
+        asyncio.run(store.upload_stream("b.wav", _chunks([b"aa", b"bb", b"cc"], fail_after=2)))
+
+    assert "b.wav" not in store.blobs
+    assert store.cancelled == [store._block_id(0)]
@@ -0,0 +1,81 @@
+import time
+
+from cache import LRUCache, ResponseCache, SessionCache
+
+
+def test_lru_cache_evicts_oldest_and_expires():
+    cache = LRUCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    cache.set("d", 4, ttl=-1)
+    assert cache.get("d") is None
+
+
+def test_response_cache_key_normalizes_prompt():
+    assert ResponseCache.make_key("chat", "مرحبا   بك\n", voice="alloy") == \
+        ResponseCache.make_key("chat", "مرحبا بك", voice="alloy")
+    assert ResponseCache.make_key("chat", "a") != ResponseCache.make_key("speech", "a")
+
+
+def test_session_cache_invalidation():
+    cache = SessionCache()
+    cache.set("token-1", ("s1", "c1", "key"), cache.generation("s1"))
+    cache.set("token-2", ("s2", "c1", "key"), cache.generation("s2"))
+    cache.invalidate_session("s1")
+    assert cache.get("token-1") is None
+    assert cache.get("token-2") == ("s2", "c1", "key")
+    cache.set("token-1", ("s1", "c1", "key"), cache.generation("s1"))
+    assert cache.get("token-1") == ("s1", "c1", "key")
+
+
+def test_session_cache_generations_are_bounded():
+    cache = SessionCache(max_entries=3)
+    cache.set("token-0", ("s0", "c1", "key"), cache.generation("s0"))
+    for i in range(100):
+        cache.invalidate_session(f"s{i}")
+    assert len(cache._generations) <= 3
+    assert cache.get("token-0") is None
+
+
+def test_session_cache_generation_expiry_does_not_revive_stale_records():
+    cache = SessionCache(ttl=0.05)
+    cache.invalidate_session("s1")
+    cache.set("token-1", ("s1", "c1", "old-key"), cache.generation("s1"))
+    time.sleep(0.06)
+    # الجيل والسجل انتهيا معاً؛ إبطال جديد يعطي رقماً لم يُستخدم من قبل
+    cache.invalidate_session("s1")
+    cache.tokens.set("token-1", (("s1", "c1", "old-key"), 1))
+    assert cache.get("token-1") is None
+
+
+def test_session_cache_invalidation_during_lookup():
+    cache = SessionCache()
+    # القراءة من القاعدة بدأت قبل الإبطال وانتهت بعده، فالسجل المقروء قديم
+    generation = cache.generation("s1")
+    cache.invalidate_session("s1")
+    cache.set("token-1", ("s1", "c1", "old-key"), generation)
+    assert cache.get("token-1") is None
+
+
+def test_authorize_does_not_cache_record_invalidated_mid_lookup(api):
+    handler = api.handler
+    session_id, token = api.session()
+    select = handler.db1.select
+
+    def racing_select(*args, **kwargs):
+        rows = select(*args, **kwargs)
+        # تعديل الجلسة من طلب آخر بين قراءة السجل وتخزينه
+        handler.db1.update("Sessions", {"Token": "new-key"}, "SessionId=?", (session_id,))
+        handler.sessions.invalidate_session(session_id)
+        return rows
+
+    handler.db1.select = racing_select
+    assert handler._authorize(token).api_key != "new-key"
+    handler.db1.select = select
+    assert handler.sessions.get(token) is None
+    assert api.portal.call(handler._authorize_async, token).api_key == "new-key"
+    assert handler.sessions.get(token).api_key == "new-key"
@@ -0,0 +1,43 @@
+import pytest
+
+from sqlitedb import CompanyDB, JobDB, SessionDB
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "plan.db")
+    for table in (CompanyDB(path), SessionDB(path), JobDB(path)):
+        table.create_table()
+        table.close()
+    db = SessionDB(path)
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize("query, params, plan, full_scan", [
+    ("SELECT * FROM Company", (), ["SCAN Company"], True),
+    # المرور على الجدول كاملاً عبر فهرس يبقى full scan
+    ("SELECT * FROM Company ORDER BY Name", (), ["SCAN Company USING INDEX idx_company_name"], True),
+    ("SELECT * FROM Sessions WHERE Status = 'Active'", (),
+     ["SCAN Sessions USING INDEX idx_sessions_company_active"], True),
+    ("SELECT Name FROM Company", (), ["SCAN Company USING COVERING INDEX idx_company_name"], True),
+    ("SELECT * FROM Sessions WHERE SessionId = ?", ("s",),
+     ["SEARCH Sessions USING INDEX sqlite_autoindex_Sessions_1 (SessionId=?)"], False),
+    ("SELECT SessionId FROM Sessions WHERE CompanyId = ? AND Status = 'Active' AND SessionId > ? "
+     "ORDER BY SessionId LIMIT 10", ("c", "a"),
+     ["SEARCH Sessions USING INDEX idx_sessions_company_active (CompanyId=? AND SessionId>?)"], False),
+    ("SELECT * FROM Company WHERE rowid > ?", (1,), ["SEARCH Company USING INTEGER PRIMARY KEY (rowid>?)"], False),
+    ("SELECT 1", (), ["SCAN CONSTANT ROW"], False),
+])
+def test_explain_flags_every_table_walk(db, query, params, plan, full_scan):
+    result = db.explain(query, params)
+    assert result["plan"] == plan
+    assert result["full_scan"] is full_scan
+    assert result["full_scans"] == (plan if full_scan else [])
+
+
+def test_pending_jobs_query_uses_status_index(db):
+    result = db.explain("SELECT JobId FROM Jobs WHERE Status = 'queued' OR (Status = 'running' AND UpdatedAt < ?) "
+                        "ORDER BY CreatedAt LIMIT ?", (0, 10))
+    assert not result["full_scan"]
+    assert all("idx_jobs_status" in index for index in result["indexes"])
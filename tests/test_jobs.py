@@ -0,0 +1,117 @@
+import asyncio
+import uuid
+
+import pytest
+
+from jobs import JobQueue, QueueFull
+from sqlitedb import JobDB, SessionDB
+
+
+@pytest.fixture
+def dbs(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    sessions, jobs = SessionDB(path), JobDB(path)
+    sessions.create_table()
+    jobs.create_table()
+    yield sessions, jobs
+    sessions.close()
+    jobs.close()
+
+
+def _used(db, session_id):
+    return db.select(db.TABLE_NAME, ["UsedOrders"], "SessionId=?", (session_id,))[0][0]
+
+
+async def _drain(queue: JobQueue):
+    await queue._queue.join()
+
+
+def test_jobs_commit_on_success_and_refund_on_failure(dbs):
+    sessions, jobs = dbs
+    session_id = sessions.add_session("company-0", uuid.uuid4().hex, "Active", 10, 0)
+    notified = []
+
+    async def runner(kind, sid, payload):
+        if payload["fail"]:
+            raise RuntimeError("boom")
+        return {"echo": payload["text"]}
+
+    async def notify(url, body):
+        notified.append((url, body["status"]))
+
+    async def scenario():
+        queue = JobQueue(jobs, sessions, runner, notify, workers=2)
+        await queue.start()
+        ok = await queue.submit(session_id, "speech", {"text": "a", "fail": False}, sessions.reserve_orders(session_id),
+                          "https://example.com/hook")
+        failed = await queue.submit(session_id, "speech", {"text": "b", "fail": True}, sessions.reserve_orders(session_id))
+        await _drain(queue)
+        await queue.aclose()
+        return ok, failed
+
+    ok, failed = asyncio.run(scenario())
+    assert jobs.get_job(ok)[3] == "succeeded"
+    assert jobs.get_job(ok)[4] == '{"echo": "a"}'
+    assert jobs.get_job(failed)[3:6] == ("failed", None, "boom")
+    assert _used(sessions, session_id) == 1
+    assert notified == [("https://example.com/hook", "succeeded")]
+
+
+def test_jobs_resume_after_restart(dbs):
+    sessions, jobs = dbs
+    session_id = sessions.add_session("company-0", uuid.uuid4().hex, "Active", 10, 0)
+    sessions.reserve_orders(session_id)
+    job_id = jobs.add_job(session_id, "speech", '{"text": "a"}', 1, None, 0.0)
+
+    async def runner(kind, sid, payload):
+        return payload["text"]
+
+    async def scenario():
+        queue = JobQueue(jobs, sessions, runner)
+        await queue.start()
+        await _drain(queue)
+        await queue.aclose()
+
+    asyncio.run(scenario())
+    assert jobs.get_job(job_id)[3] == "succeeded"
+    assert _used(sessions, session_id) == 1
+
+
+def test_queue_full(dbs):
+    sessions, jobs = dbs
+    session_id = sessions.add_session("company-0", uuid.uuid4().hex, "Active", 10, 0)
+
+    async def runner(kind, sid, payload):
+        await asyncio.sleep(1)
+
+    async def scenario():
+        queue = JobQueue(jobs, sessions, runner, workers=1, max_depth=1)
+        await queue.submit(session_id, "speech", {}, sessions.reserve_orders(session_id))
+        with pytest.raises(QueueFull):
+            await queue.submit(session_id, "speech", {}, sessions.reserve_orders(session_id))
+        await queue.aclose()
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def asyncio_debug(monkeypatch):
+    # يجب ضبطه قبل أن ينشئ TestClient الـ event loop، فيُذكر قبل api في معاملات الاختبار
+    monkeypatch.setenv("PYTHONASYNCIODEBUG", "1")
+
+
+SPEECH_OPTIONS = {"speech_deployment_name": "tts", "api_version": "v", "base_url": "https://x"}
+
+
+def test_async_speech_job_under_asyncio_debug(asyncio_debug, api):
+    assert api.portal.call(lambda: asyncio.get_running_loop().get_debug())
+    session_id, token = api.session(total_orders=5)
+    response = api.post("/company/ChatText2Speech", params={"text": "مرحبا", "Customize_the_dialect": "najdi",
+                                                            "token": token, "async_job": True},
+                        json=SPEECH_OPTIONS)
+    assert response.status_code == 202
+    job_id = response.json()["JobId"]
+    api.portal.call(_drain, api.handler.jobs)
+    job = api.get(f"/company/jobs/{job_id}", params={"token": token}).json()
+    assert job["Status"] == "succeeded" and job["Response"].endswith(".wav")
+    assert _used(api.handler.db1, session_id) == 1
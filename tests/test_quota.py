@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import uuid
+
+import pytest
+
+from quota import QuotaEngine
+from sqlitedb import DatabaseUnavailable, SessionDB
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = SessionDB(str(tmp_path / "quota.db"))
+    db.create_table()
+    yield db
+    db.close()
+
+
+def _used(db, session_id):
+    return db.select(db.TABLE_NAME, ["UsedOrders"], "SessionId=?", (session_id,))[0][0]
+
+
+def _hammer(quota, session_id, threads=16, per_thread=200):
+    committed = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        count = 0
+        barrier.wait()
+        for i in range(per_thread):
+            reservation = quota.reserve_orders(session_id)
+            if reservation is None:
+                continue
+            if i % 10 == 0:
+                reservation.refund()
+            else:
+                reservation.commit()
+                count += 1
+        with lock:
+            committed.append(count)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(committed)
+
+
+def test_concurrent_reservations_never_oversell(db):
+    session_id = db.add_session("company-0", uuid.uuid4().hex, "Active", 1000, 0)
+    committed = _hammer(db, session_id)
+    assert committed == 1000
+    assert _used(db, session_id) == 1000
+
+
+@pytest.mark.parametrize("ttl", [300, 0])
+def test_concurrent_reservations_with_write_behind_engine(db, ttl):
+    # ttl=0: الجلسة تُخرج من الذاكرة في كل كتابة أثناء الخصم المتزامن
+    session_id = db.add_session("company-0", uuid.uuid4().hex, "Active", 1000, 0)
+    engine = QuotaEngine(db, flush_interval=0.001, ttl=ttl).start()
+    committed = _hammer(engine, session_id)
+    engine.close()
+    assert committed == 1000
+    assert _used(db, session_id) == 1000
+
+
+def test_refund_returns_orders(db):
+    session_id = db.add_session("company-0", uuid.uuid4().hex, "Active", 3, 0)
+    reservation = db.reserve_orders(session_id, 3)
+    assert reservation.remaining == 0
+    assert db.reserve_orders(session_id) is None
+    reservation.refund(2)
+    assert reservation.n == 1 and reservation.remaining == 2
+    assert _used(db, session_id) == 1
+
+
+def test_unknown_session_is_not_an_error(db):
+    assert db.consume_orders("missing") is None
+    assert db.reserve_orders("missing") is None
+
+
+def test_database_errors_are_raised(tmp_path):
+    # الجدول غير موجود: يجب ألا يُفهم الخطأ على أنه "نفد الرصيد" أو "الجلسة غير موجودة"
+    db = SessionDB(str(tmp_path / "empty.db"))
+    with pytest.raises(DatabaseUnavailable):
+        db.consume_orders("session", 1)
+    with pytest.raises(DatabaseUnavailable):
+        db.refund_orders("session", 1)
+    with pytest.raises(DatabaseUnavailable):
+        QuotaEngine(db).consume_orders("session", 1)
+    db.close()
+
+
+def test_engine_sees_total_changes_after_flush(db):
+    session_id = db.add_session("company-0", uuid.uuid4().hex, "Active", 1, 0)
+    engine = QuotaEngine(db)
+    assert engine.consume_orders(session_id) == 0
+    assert engine.consume_orders(session_id) is None
+    db.update(db.TABLE_NAME, {"TotalOrders": 5}, "SessionId=?", (session_id,))
+    engine.flush()
+    assert engine.consume_orders(session_id) == 3
+    engine.close()
+    assert _used(db, session_id) == 2
+
+
+def test_engine_evicts_idle_sessions(db):
+    ids = [db.add_session("company-0", uuid.uuid4().hex, "Active", 10, 0) for _ in range(5)]
+    engine = QuotaEngine(db, ttl=3600, max_entries=2)
+    for session_id in ids:
+        engine.consume_orders(session_id)
+    engine.flush()
+    assert len(engine._entries) == 2
+    assert set(engine._entries) == set(ids[-2:])
+
+    engine.ttl = 0
+    engine.flush()
+    assert not engine._entries
+    # بعد الإخراج يُعاد تحميل الجلسة من القاعدة دون فقدان ما خُصم
+    assert engine.consume_orders(ids[0]) == 8
+    engine.close()
+    assert [_used(db, session_id) for session_id in ids] == [2, 1, 1, 1, 1]
+
+
+def test_async_reservation_refunds_on_error(db):
+    session_id = db.add_session("company-0", uuid.uuid4().hex, "Active", 2, 0)
+
+    async def scenario():
+        async with db.reserve_orders(session_id):
+            pass
+        with pytest.raises(RuntimeError):
+            async with db.reserve_orders(session_id):
+                raise RuntimeError("upstream failed")
+
+    asyncio.run(scenario())
+    assert _used(db, session_id) == 1
@@ -0,0 +1,125 @@
+import pytest
+
+import ratelimit
+from ratelimit import RateLimited, RateLimiter
+from sqlitedb import RateLimitDB
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "shared"])
+def limiter(request, tmp_path, clock):
+    def make(**kwargs):
+        db = None
+        if request.param == "shared":
+            db = RateLimitDB(str(tmp_path / "rate.db"))
+            db.create_table()
+        return RateLimiter(db=db, **kwargs)
+    return make
+
+
+def _rejected(limiter, *args):
+    with pytest.raises(RateLimited) as e:
+        limiter.acquire(*args)
+    return e.value.retry_after
+
+
+def test_burst_then_refill(limiter, clock):
+    limiter = limiter(session_rate=2.0, session_burst=3, company_rate=100.0, company_burst=100)
+    for _ in range(3):
+        limiter.acquire("s1", "c1").release()
+    assert _rejected(limiter, "s1", "c1") == pytest.approx(0.5)
+    clock.now += 0.5
+    limiter.acquire("s1", "c1").release()
+    # دلو كل جلسة مستقل
+    limiter.acquire("s2", "c1").release()
+
+
+def test_company_bucket_shared_by_sessions(limiter, clock):
+    limiter = limiter(session_rate=100.0, session_burst=100, company_rate=1.0, company_burst=2)
+    limiter.acquire("s1", "c1").release()
+    limiter.acquire("s2", "c1").release()
+    assert _rejected(limiter, "s3", "c1") == pytest.approx(1.0)
+    limiter.acquire("s3", "c2").release()
+
+
+def test_batches_are_charged_in_full(limiter, clock):
+    limiter = limiter(session_rate=10.0, session_burst=20, company_rate=1000.0, company_burst=1000)
+    # دفعة أكبر من الدلو تُقبل حين يمتلئ، لكنها تتركه مديناً بالفرق
+    limiter.acquire("s1", "c1", 50).release()
+    assert _rejected(limiter, "s1", "c1") == pytest.approx(3.1)
+    assert _rejected(limiter, "s1", "c1", 20) == pytest.approx(5.0)
+    clock.now += 3.1
+    limiter.acquire("s1", "c1").release()
+    # الإنتاجية على المدى الطويل لا تتجاوز المعدل مهما كبرت الدفعات
+    clock.now += 100
+    admitted = 0
+    for _ in range(100):
+        clock.now += 1
+        try:
+            limiter.acquire("s1", "c1", 100).release()
+            admitted += 100
+        except RateLimited:
+            pass
+    assert admitted <= 10.0 * 100 + 100
+
+
+def test_in_flight_cap_and_lease_release(limiter, clock):
+    limiter = limiter(max_in_flight=2)
+    first, second = limiter.acquire("s1", "c1"), limiter.acquire("s1", "c1")
+    assert _rejected(limiter, "s1", "c1") == 1.0
+    first.release()
+    first.release()
+    assert limiter.stats()["in_flight"] == 1
+    with limiter.acquire("s1", "c1"):
+        assert limiter.stats()["in_flight"] == 2
+    assert limiter.stats()["in_flight"] == 1
+    # transfer: الكتلة الحالية لا تحرره، ومن استلمه يحرره مرة واحدة
+    with second:
+        moved = second.transfer()
+    assert limiter.stats()["in_flight"] == 1
+    moved.release()
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_rejection_does_not_hold_a_slot(limiter, clock):
+    limiter = limiter(session_rate=1.0, session_burst=1, max_in_flight=1)
+    limiter.acquire("s1", "c1").release()
+    _rejected(limiter, "s1", "c1")
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_api_returns_429_with_retry_after(api):
+    api.handler.rate_limiter = RateLimiter(session_rate=0.25, session_burst=2)
+    _, token = api.session()
+    params = {"message": "hi", "Customize_the_dialect": "najdi", "token": token}
+    options = {"text_deployment_name": "gpt-4o", "api_version": "v", "base_url": "https://x", "use_cache": False}
+    assert [api.post("/company/T2T", params=params, json=options).status_code for _ in range(2)] == [200, 200]
+    response = api.post("/company/T2T", params=params, json=options)
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= 4
+    assert api.handler.rate_limiter.stats()["in_flight"] == 0
+
+    # دفعة بحجم 10 تُحسب عشرة طلبات
+    api.handler.rate_limiter = RateLimiter(session_rate=1.0, session_burst=5)
+    batch = {"messages": ["a"] * 10, "options": options}
+    response = api.post("/company/T2T/batch", params={"Customize_the_dialect": "najdi", "token": token}, json=batch)
+    assert response.status_code == 200
+    response = api.post("/company/T2T", params=params, json=options)
+    assert response.status_code == 429 and int(response.headers["Retry-After"]) >= 5
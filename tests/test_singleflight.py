@@ -0,0 +1,50 @@
+import asyncio
+
+from singleflight import SingleFlight, scoped_key
+
+
+def test_identical_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def scenario():
+        key = scoped_key("prompt", "key-a")
+        return await asyncio.gather(*(flights.do(key, fetch) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["result"] * 5
+    assert len(calls) == 1
+    assert flights.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 4}
+
+
+def test_failure_with_one_credential_does_not_fail_other_credentials():
+    flights = SingleFlight()
+
+    async def fetch(api_key):
+        await asyncio.sleep(0.01)
+        if api_key == "expired":
+            raise RuntimeError("401 Unauthorized")
+        return f"ok:{api_key}"
+
+    async def scenario():
+        return await asyncio.gather(
+            *(flights.do(scoped_key("prompt", api_key), lambda api_key=api_key: fetch(api_key))
+              for api_key in ("expired", "valid", "valid")),
+            return_exceptions=True
+        )
+
+    expired, valid, shared = asyncio.run(scenario())
+    assert isinstance(expired, RuntimeError)
+    assert valid == shared == "ok:valid"
+    assert flights.leaders == 2
+
+
+def test_scoped_key_does_not_leak_credential():
+    key = scoped_key("prompt", "secret-api-key")
+    assert key.startswith("prompt:")
+    assert "secret-api-key" not in key
+    assert key != scoped_key("prompt", "other-key")
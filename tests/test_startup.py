@@ -0,0 +1,31 @@
+import os
+
+from bench.startup import bench_startup
+
+# نفس الحد الافتراضي في bench/run.py؛ يمكن رفعه على أجهزة CI البطيئة
+IMPORT_BUDGET_MS = float(os.environ.get("LHJA_IMPORT_BUDGET_MS", 1500))
+
+
+def test_import_main_within_budget():
+    result = bench_startup("main", runs=3, budget_ms=IMPORT_BUDGET_MS)
+    assert result["within_budget"], (
+        f"import main took {result['median_ms']} ms (median of {result['runs']}), "
+        f"budget is {IMPORT_BUDGET_MS:.0f} ms"
+    )
+
+
+def test_app_lifespan_runs_handler_lifecycle(tmp_path, recwarn):
+    from fastapi.testclient import TestClient
+
+    from blob_store import InMemoryBlobStore
+    from encrypt import UserHandler
+    from main import create_app
+
+    handler = UserHandler(db_file=str(tmp_path / "app.db"), blob_store=InMemoryBlobStore())
+    app = create_app(enable_gradio=False, handler=handler)
+    # on_event مهمل في Starlette 1.x؛ الإقلاع والإيقاف عبر lifespan فقط
+    assert not [w for w in recwarn if "on_event" in str(w.message)]
+    with TestClient(app) as client:
+        assert client.get("/company/sessions").status_code == 200
+        assert handler.jobs._queue is not None
+    assert handler.jobs._queue is None
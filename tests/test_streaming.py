@@ -0,0 +1,121 @@
+import asyncio
+import json
+from urllib.parse import urlencode
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+from upstream import UpstreamError
+
+OPTIONS = {"text_deployment_name": "gpt-4o", "api_version": "v", "base_url": "https://x", "use_cache": False}
+# جلسة فيها طلبات مستخدمة مسبقاً، فيظهر أي خصم أو إعادة مكررة في UsedOrders
+USED_BEFORE = 5
+
+
+@pytest.fixture
+def stream(api):
+    handler = api.handler
+    session_id = handler.db1.add_session("company-1", "azure-key", "Active", 100, USED_BEFORE)
+    token = handler.cipher.encrypt(session_id)
+
+    def settle():
+        handler.usage.flush()
+        used = handler.db1.select("Sessions", ["UsedOrders"], "SessionId=?", (session_id,))[0][0]
+        rows = handler.usage.db.select("UsageLedger", ["Endpoint", "Status", "Orders"], "SessionId=?", (session_id,))
+        return used, handler.rate_limiter.stats()["in_flight"], rows
+
+    api.settle = settle
+    api.params = {"message": "hi", "Customize_the_dialect": "najdi", "token": token, "stream": True}
+    return api
+
+
+def _upstream(api, *chunks, fail=False, hang=False):
+    async def fake(text, api_key, meter=None):
+        for chunk in chunks:
+            yield chunk
+        if fail:
+            raise UpstreamError("upstream dropped")
+        if hang:
+            await asyncio.Event().wait()
+
+    api.handler.stream_chat_with_gpt = fake
+
+
+def _events(body: str):
+    return [block for block in body.split("\n\n") if block]
+
+
+def test_stream_completes_and_commits(stream):
+    _upstream(stream, "a", "b")
+    response = stream.post("/company/T2T", params=stream.params, json=OPTIONS)
+    assert response.status_code == 200
+    events = _events(response.text)
+    assert [json.loads(e[len("data: "):])["delta"] for e in events[:2]] == ["a", "b"]
+    assert events[-1].startswith("event: done")
+    assert stream.settle() == (USED_BEFORE + 1, 0, [("/T2T", 200, 1)])
+
+
+def test_failure_before_first_chunk_refunds(stream):
+    _upstream(stream, fail=True)
+    response = stream.post("/company/T2T", params=stream.params, json=OPTIONS)
+    assert response.status_code == 502
+    assert stream.settle() == (USED_BEFORE, 0, [("/T2T", 502, 0)])
+
+
+def test_failure_mid_stream_refunds_once(stream):
+    _upstream(stream, "a", fail=True)
+    response = stream.post("/company/T2T", params=stream.params, json=OPTIONS)
+    assert response.status_code == 200
+    events = _events(response.text)
+    assert events[-1].startswith("event: error") and "upstream dropped" in events[-1]
+    # الطلب المُعاد لا يُحتسب في سجل الاستخدام
+    assert stream.settle() == (USED_BEFORE, 0, [("/T2T", 502, 0)])
+
+
+async def _disconnecting_request(app, path, params, body, mode, sent_before_disconnect):
+    """
+    طلب ASGI مباشر ينقطع فيه العميل بعد وصول sent_before_disconnect رسالة من الاستجابة.
+    mode="send_error": الانقطاع يظهر كـ OSError من send التالية (ASGI 2.4 كما في uvicorn)، فعند 0
+    لا يبدأ المرور على المحتوى أصلاً. mode="receive": رسالة http.disconnect (ASGI < 2.4)
+    """
+    disconnected = asyncio.Event()
+    requested = False
+    sent = 0
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal sent
+        if mode == "send_error" and sent >= sent_before_disconnect:
+            raise OSError("connection reset")
+        sent += 1
+        if sent >= sent_before_disconnect:
+            disconnected.set()
+
+    scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4" if mode == "send_error" else "2.3"},
+             "http_version": "1.1", "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(),
+             "root_path": "", "query_string": urlencode(params).encode(), "client": ("test", 1),
+             "server": ("test", 80), "headers": [(b"host", b"test"), (b"content-type", b"application/json")]}
+    try:
+        await asyncio.wait_for(app(scope, receive, send), 5)
+    except asyncio.TimeoutError:
+        raise
+    except (OSError, ClientDisconnect):
+        pass
+
+
+@pytest.mark.parametrize("mode, sent_before_disconnect", [
+    ("send_error", 0), ("send_error", 1), ("receive", 1), ("receive", 2),
+])
+def test_client_disconnect_settles_once(stream, mode, sent_before_disconnect):
+    # الخدمة ترسل جزءاً ثم تتوقف دون إغلاق؛ انقطاع العميل يجب أن يعتمد الخصم ويحرر الـ lease
+    _upstream(stream, "a", hang=True)
+    stream.portal.call(_disconnecting_request, stream.app, "/company/T2T", stream.params,
+                       json.dumps(OPTIONS).encode(), mode, sent_before_disconnect)
+    assert stream.settle() == (USED_BEFORE + 1, 0, [("/T2T", 200, 1)])
@@ -0,0 +1,81 @@
+import pytest
+
+OPTIONS = {"text_deployment_name": "gpt-4o", "api_version": "v", "base_url": "https://x", "use_cache": False}
+
+
+@pytest.fixture
+def usage(api):
+    # جلستان لنفس الشركة وجلسة لشركة أخرى، لكل منها عدد مختلف من الطلبات
+    tokens = {}
+    for name, company_id, calls in (("first", "company-1", 2), ("second", "company-1", 1), ("other", "company-2", 4)):
+        _, token = api.session(company_id=company_id)
+        tokens[name] = token
+        for _ in range(calls):
+            response = api.post("/company/T2T", params={"message": "hi", "Customize_the_dialect": "najdi",
+                                                        "token": token}, json=OPTIONS)
+            assert response.status_code == 200
+    api.handler.usage.flush()
+    api.tokens = tokens
+    return api
+
+
+def _report(api, token, **params):
+    return api.get("/company/usage", params={"token": token, **params})
+
+
+@pytest.mark.parametrize("granularity", ["hour", "day"])
+def test_usage_report_per_company(usage, granularity):
+    response = _report(usage, usage.tokens["first"], granularity=granularity)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["CompanyId"] == "company-1" and body["Granularity"] == granularity
+    (row,) = body["Usage"]
+    assert (row["endpoint"], row["calls"], row["errors"], row["orders"]) == ("/T2T", 3, 0, 3)
+    assert row["bucket"].endswith("+00:00")
+    assert row["avg_latency_ms"] is not None and row["max_latency_ms"] >= row["avg_latency_ms"]
+
+
+def test_usage_report_session_scope(usage):
+    (row,) = _report(usage, usage.tokens["first"], scope="session").json()["Usage"]
+    assert row["calls"] == 2
+    (row,) = _report(usage, usage.tokens["second"], scope="session").json()["Usage"]
+    assert row["calls"] == 1
+    (row,) = _report(usage, usage.tokens["other"]).json()["Usage"]
+    assert row["calls"] == 4
+
+
+def test_usage_report_explicit_range(usage):
+    # فترة في الماضي لا استخدام فيها؛ والبداية بلا منطقة زمنية تُقرأ UTC
+    response = _report(usage, usage.tokens["first"], granularity="day", start="2020-01-01", end="2020-12-31T00:00:00Z")
+    assert response.status_code == 200 and response.json()["Usage"] == []
+
+
+@pytest.mark.parametrize("params", [
+    {"granularity": "hour", "start": "2024-01-01T00:00:00", "end": "2024-02-01T00:00:01"},
+    {"granularity": "day", "start": "2024-01-01", "end": "2025-01-02"},
+    {"granularity": "hour", "start": "2024-01-02", "end": "2024-01-01"},
+    {"granularity": "hour", "start": "2024-01-01", "end": "2024-01-01"},
+])
+def test_usage_report_range_caps(usage, params):
+    response = _report(usage, usage.tokens["first"], **params)
+    assert response.status_code == 400
+
+
+def test_usage_report_range_at_cap(usage):
+    assert _report(usage, usage.tokens["first"], granularity="hour", start="2024-01-01",
+                   end="2024-02-01").status_code == 200
+    assert _report(usage, usage.tokens["first"], granularity="day", start="2024-01-01",
+                   end="2025-01-01").status_code == 200
+
+
+@pytest.mark.parametrize("params, detail", [
+    ({"start": "yesterday"}, "Invalid ISO 8601 time: yesterday"),
+    ({"end": "2024-13-01"}, "Invalid ISO 8601 time: 2024-13-01"),
+    ({"granularity": "minute"}, "granularity must be 'hour' or 'day'"),
+    ({"scope": "everyone"}, "scope must be 'company' or 'session'"),
+])
+def test_usage_report_bad_input(usage, params, detail):
+    response = _report(usage, usage.tokens["first"], **params)
+    assert response.status_code == 400
+    assert response.json()["detail"] == detail
+
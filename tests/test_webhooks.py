@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+
+import pytest
+
+from webhooks import WebhookRejected, Webhooks
+
+HOSTS = {
+    "hooks.example.com": ["93.184.216.34"],
+    "rebind.example.com": ["93.184.216.34", "10.0.0.5"],
+    "internal.corp": ["10.1.2.3"],
+}
+
+
+async def _resolver(host, port):
+    if host in HOSTS:
+        return HOSTS[host]
+    # العناوين الحرفية تمر كما هي مثل getaddrinfo
+    try:
+        return [str(ipaddress.ip_address(host))]
+    except ValueError:
+        raise OSError("Name or service not known")
+
+
+def _webhooks(**kwargs):
+    return Webhooks(b"secret", resolver=_resolver, **kwargs)
+
+
+@pytest.mark.parametrize("url", [
+    "https://hooks.example.com/done",
+    "http://93.184.216.34:8080/done",
+])
+def test_public_urls_accepted(url):
+    asyncio.run(_webhooks().validate(url))
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://hooks.example.com/done",
+    "https:///done",
+    "http://127.0.0.1:8000/admin",
+    "http://localhost.invalid/",
+    "http://10.0.0.1/",
+    "http://192.168.1.1/",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://100.64.0.1/",
+    "http://0.0.0.0/",
+    "http://[::1]/",
+    "http://[::ffff:127.0.0.1]/",
+    "http://[fe80::1]/",
+    "http://224.0.0.1/",
+    # يكفي عنوان داخلي واحد بين عناوين الاسم
+    "https://rebind.example.com/done",
+    "https://internal.corp/done",
+])
+def test_private_urls_rejected(url):
+    with pytest.raises(WebhookRejected):
+        asyncio.run(_webhooks().validate(url))
+
+
+def test_allowlist():
+    webhooks = _webhooks(allowed_hosts=["internal.corp"])
+    asyncio.run(webhooks.validate("https://internal.corp/done"))
+    with pytest.raises(WebhookRejected):
+        asyncio.run(webhooks.validate("https://hooks.example.com/done"))
+
+
+def test_disabled_without_secret():
+    with pytest.raises(WebhookRejected, match="LHJA_WEBHOOK_SECRET"):
+        asyncio.run(Webhooks(None, resolver=_resolver).validate("https://hooks.example.com/done"))
+
+
+def test_signature():
+    headers = _webhooks().sign(b'{"a": 1}', timestamp=1700000000)
+    expected = hmac.new(b"secret", b'1700000000.{"a": 1}', hashlib.sha256).hexdigest()
+    assert headers == {"X-Lhja-Timestamp": "1700000000", "X-Lhja-Signature": f"sha256={expected}"}
+
+
+def test_api_rejects_internal_webhook(api):
+    api.handler.webhooks = _webhooks()
+    response = api.post("/company/ChatText2Speech",
+                        params={"text": "hi", "Customize_the_dialect": "najdi", "token": "t", "async_job": True,
+                                "webhook_url": "http://169.254.169.254/latest/meta-data/"},
+                        json={"speech_deployment_name": "tts", "api_version": "v", "base_url": "https://x"})
+    assert response.status_code == 400
+    assert "non-public" in response.json()["detail"]
+
+
+def test_delivery_is_signed_and_revalidated(api):
+    sent = []
+
+    class Upstream:
+        async def post(self, url, json, headers, service="upstream", content=None):
+            sent.append((url, headers, content))
+            return type("Response", (), {"status_code": 204})()
+
+        async def aclose(self):
+            pass
+
+    handler = api.handler
+    handler.webhooks = _webhooks()
+    handler.upstream = Upstream()
+    body = {"job_id": "j1", "status": "succeeded", "result": "https://blob/x.wav", "error": None}
+    asyncio.run(handler._deliver_webhook("https://hooks.example.com/done", body))
+    (url, headers, content), = sent
+    assert json.loads(content) == body
+    expected = hmac.new(b"secret", headers["X-Lhja-Timestamp"].encode() + b"." + content, hashlib.sha256)
+    assert headers["X-Lhja-Signature"] == f"sha256={expected.hexdigest()}"
+
+    # الاسم صار يُحل إلى عنوان داخلي بعد إضافة المهمة
+    with pytest.raises(WebhookRejected):
+        asyncio.run(handler._deliver_webhook("https://rebind.example.com/done", body))
+    assert len(sent) == 1
@@ -0,0 +1,118 @@
+import asyncio
+import random
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from metrics import UPSTREAM_REQUEST_SECONDS
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class UpstreamClient:
+    """
+    عميل HTTP غير متزامن ومشترك لخدمات Azure (المحادثة وتحويل النص إلى كلام).
+
+    يعيد استخدام الاتصالات (keep-alive) ويستعمل HTTP/2 إن توفرت مكتبة h2،
+    ويعيد المحاولة مع تأخير أُسّي عند أخطاء الشبكة و 429/5xx.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, max_connections: int = 200, max_keepalive_connections: int = 50,
+                 keepalive_expiry: float = 30.0, timeout: float = 60.0, connect_timeout: float = 5.0,
+                 retries: int = 2, backoff: float = 0.5, max_backoff: float = 8.0, http2: bool = True):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.http2 = http2 and _http2_available()
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=self.http2)
+        return self._client
+
+    def _delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.max_backoff)
+        delay = min(self.backoff * (2 ** attempt), self.max_backoff)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def post(self, url: str, json: Dict[str, Any], headers: Dict[str, str],
+                   service: str = "upstream", content: bytes = None) -> httpx.Response:
+        """
+        service: اسم الخدمة في مقاييس زمن الاستدعاء (chat، tts ...)؛ تُقاس كل محاولة على حدة.
+        content: محتوى جاهز يُرسل كما هو بدلاً من json (مثل محتوى webhook موقّع)
+        """
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = await self.client.post(url, json=json, content=content, headers=headers)
+            except httpx.TransportError as e:
+                UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - start, service, "error")
+                if attempt >= self.retries:
+                    raise UpstreamError(f"Upstream request failed: {e}") from e
+                await asyncio.sleep(self._delay(attempt))
+            else:
+                UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - start, service, str(response.status_code))
+                if response.status_code not in self.RETRY_STATUSES or attempt >= self.retries:
+                    return response
+                await asyncio.sleep(self._delay(attempt, response))
+            attempt += 1
+
+    async def _stream(self, url: str, json: Dict[str, Any], headers: Dict[str, str], lines: bool,
+                      chunk_size: int = None, service: str = "upstream"):
+        # زمن البث يُقاس حتى آخر جزء، والحالة "error" إذا انقطع الاتصال
+        start = time.perf_counter()
+        status = "error"
+        try:
+            async with self.client.stream("POST", url, json=json, headers=headers) as response:
+                status = str(response.status_code)
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise UpstreamError(f"Error: {response.status_code}\n{body.decode('utf-8', 'replace')}")
+                parts = response.aiter_lines() if lines else response.aiter_bytes(chunk_size)
+                async for part in parts:
+                    yield part
+        except httpx.TransportError as e:
+            status = "error"
+            raise UpstreamError(f"Upstream stream failed: {e}") from e
+        finally:
+            UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - start, service, status)
+
+    def stream_lines(self, url: str, json: Dict[str, Any], headers: Dict[str, str], service: str = "upstream"):
+        """
+        إرسال طلب والبث سطراً بسطر (SSE). لا تُعاد المحاولة بعد بدء البث.
+        """
+        return self._stream(url, json, headers, lines=True, service=service)
+
+    def stream_bytes(self, url: str, json: Dict[str, Any], headers: Dict[str, str], chunk_size: int = 64 * 1024,
+                     service: str = "upstream"):
+        return self._stream(url, json, headers, lines=False, chunk_size=chunk_size, service=service)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,139 @@
+import atexit
+import contextvars
+import threading
+import time
+from typing import Dict, List, Optional
+
+from logs import get_logger
+from sqlitedb import UsageDB
+
+logger = get_logger("lhja.usage")
+
+
+class UsageMeter:
+    """
+    ما استهلكه الطلب الحالي من tokens و bytes، يُجمع من طبقات الاستدعاء عبر contextvar.
+    deferred=True عندما يستمر الطلب بعد انتهاء الدالة (البث) فيُسجَّل عند اكتماله
+    """
+    __slots__ = ("started", "deferred", "orders", "input_tokens", "output_tokens", "bytes")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.deferred = False
+        self.orders = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.bytes = 0
+
+
+current_meter: contextvars.ContextVar = contextvars.ContextVar("usage_meter", default=None)
+
+
+def add_usage(input_tokens: int = 0, output_tokens: int = 0, nbytes: int = 0, meter: UsageMeter = None):
+    meter = meter or current_meter.get()
+    if meter is not None:
+        meter.input_tokens += input_tokens or 0
+        meter.output_tokens += output_tokens or 0
+        meter.bytes += nbytes or 0
+
+
+class UsageRecorder:
+    """
+    تسجيل الاستخدام بكتابة مؤجلة: الاستدعاءات تُضاف إلى مخزن في الذاكرة، ثم تُكتب دفعة واحدة
+    كل flush_interval ثانية أو عند بلوغ flush_threshold سجلاً، مع تحديث جداول التجميع بالساعة
+    واليوم في نفس المعاملة. عند تعذّر الكتابة يُحتفظ بما لا يتجاوز max_buffer سجلاً ويُسقط الأقدم.
+    """
+
+    def __init__(self, db: UsageDB, flush_interval: float = 1.0, flush_threshold: int = 1000,
+                 max_buffer: int = 100000, retention_days: Optional[float] = 90):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.max_buffer = max_buffer
+        self.retention_days = retention_days
+        self._buffer: List[tuple] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._next_purge = 0.0
+        self.dropped = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="usage-flush", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            self._purge()
+
+    def record(self, session_id: str, company_id: str, endpoint: str, status: int, meter: UsageMeter):
+        latency_ms = (time.perf_counter() - meter.started) * 1000
+        row = (time.time(), session_id, company_id or "", endpoint, status, meter.orders, latency_ms,
+               meter.input_tokens, meter.output_tokens, meter.bytes)
+        with self._lock:
+            self._buffer.append(row)
+            pending = len(self._buffer)
+        if pending >= self.flush_threshold:
+            self._wakeup.set()
+
+    @staticmethod
+    def rollup(rows: List[tuple], seconds: int) -> List[tuple]:
+        totals: Dict[tuple, list] = {}
+        for at, session_id, company_id, endpoint, status, orders, latency, tokens_in, tokens_out, nbytes in rows:
+            key = (company_id, int(at // seconds * seconds), session_id, endpoint)
+            entry = totals.get(key)
+            if entry is None:
+                entry = totals[key] = [0, 0, 0, 0.0, 0.0, 0, 0, 0]
+            entry[0] += 1
+            entry[1] += status >= 400
+            entry[2] += orders
+            entry[3] += latency
+            entry[4] = max(entry[4], latency)
+            entry[5] += tokens_in
+            entry[6] += tokens_out
+            entry[7] += nbytes
+        return [key + tuple(entry) for key, entry in totals.items()]
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            rollups = {granularity: self.rollup(rows, seconds)
+                       for granularity, seconds in UsageDB.ROLLUP_SECONDS.items()}
+            if self.db.write_usage(rows, rollups):
+                return len(rows)
+            # إعادة السجلات للمحاولة التالية، مع حد أعلى حتى لا تنمو الذاكرة أثناء تعطل القاعدة
+            with self._lock:
+                self._buffer = rows + self._buffer
+                overflow = len(self._buffer) - self.max_buffer
+                if overflow > 0:
+                    del self._buffer[:overflow]
+                    self.dropped += overflow
+            return 0
+
+    def _purge(self):
+        now = time.time()
+        if not self.retention_days or now < self._next_purge:
+            return
+        self._next_purge = now + 3600
+        self.db.purge_ledger(now - self.retention_days * 86400)
+
+    def stats(self):
+        return {"buffered": len(self._buffer), "dropped": self.dropped}
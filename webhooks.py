@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+
+class WebhookRejected(Exception):
+    pass
+
+
+async def _resolve(host: str, port: int) -> List[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    # is_global يستبعد الشبكات الخاصة و loopback و link-local (169.254.169.254) والمحجوزة و 100.64.0.0/10
+    return ip.is_global and not ip.is_multicast
+
+
+class Webhooks:
+    """
+    التحقق من عناوين الـ webhook وتوقيع محتواها.
+
+    العنوان يُرفض إذا كان أحد عناوين IP التي يُحل إليها خاصاً أو loopback أو link-local أو محجوزاً،
+    حتى لا يُستخدم الخادم للوصول إلى الشبكة الداخلية (SSRF). يُعاد التحقق عند الإرسال لأن DNS قد يتغير
+    بعد الإضافة. allowed_hosts (LHJA_WEBHOOK_ALLOWED_HOSTS) يقصر الإرسال على أسماء محددة يثق بها المشغّل
+    ولو كانت داخلية.
+
+    كل إرسال يحمل X-Lhja-Timestamp و X-Lhja-Signature = sha256=HMAC-SHA256(secret, "{timestamp}.{body}")
+    ليتحقق المستقبل من المصدر ويرفض الرسائل القديمة. دون LHJA_WEBHOOK_SECRET تُرفض طلبات الـ webhook.
+    """
+
+    SIGNATURE_HEADER = "X-Lhja-Signature"
+    TIMESTAMP_HEADER = "X-Lhja-Timestamp"
+
+    def __init__(self, secret: Optional[bytes] = None, allowed_hosts: Iterable[str] = None,
+                 resolver: Callable[[str, int], Awaitable[List[str]]] = None):
+        self.secret = secret
+        self.allowed_hosts = {host.strip().lower() for host in allowed_hosts or [] if host.strip()}
+        self.resolver = resolver or _resolve
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "Webhooks":
+        secret = os.environ.get("LHJA_WEBHOOK_SECRET")
+        allowed = os.environ.get("LHJA_WEBHOOK_ALLOWED_HOSTS", "")
+        return cls(secret.encode("utf-8") if secret else None, allowed.split(","), **kwargs)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.secret)
+
+    async def validate(self, url: str):
+        """
+        ترفع WebhookRejected إذا لم يكن العنوان مسموحاً
+        """
+        if not self.enabled:
+            raise WebhookRejected("Webhooks are disabled (LHJA_WEBHOOK_SECRET is not set)")
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise WebhookRejected("webhook_url must be an http(s) URL")
+        host = parts.hostname.lower()
+        if self.allowed_hosts:
+            if host not in self.allowed_hosts:
+                raise WebhookRejected(f"webhook_url host {host} is not allowed")
+            return
+        try:
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+            addresses = await self.resolver(host, port)
+        except (OSError, ValueError) as e:
+            raise WebhookRejected(f"webhook_url host {host} cannot be resolved: {e}")
+        if not addresses or not all(_is_public(address) for address in addresses):
+            raise WebhookRejected(f"webhook_url host {host} resolves to a non-public address")
+
+    def sign(self, body: bytes, timestamp: int = None) -> Dict[str, str]:
+        timestamp = str(int(time.time()) if timestamp is None else timestamp)
+        digest = hmac.new(self.secret, timestamp.encode("ascii") + b"." + body, hashlib.sha256).hexdigest()
+        return {self.TIMESTAMP_HEADER: timestamp, self.SIGNATURE_HEADER: f"sha256={digest}"}